@@ -4,4 +4,11 @@ import cloud_manager.webserver as webserver
 import cloud_manager.api as api
 import cloud_manager.datamodel as datamodel
 import cloud_manager.common.mongo_util as mongo_util
+import cloud_manager.common.cache as cache
+import cloud_manager.common.catalog as catalog
+import cloud_manager.common.db_backend as db_backend
+import cloud_manager.common.invalidation as invalidation
+import cloud_manager.common.metrics as metrics
+import cloud_manager.common.resumable as resumable
+import cloud_manager.common.upload as upload
 import cloud_manager.file_management as file_management
@@ -6,7 +6,7 @@ Licensing Information found at: https://intecrate.co/legal/license
 """
 
 from typing import Type
-from cloud_manager.common.base import BaseHandler
+from cloud_manager.common.base import BaseHandler, StreamingHandler, UploadHandler
 
 # Load handlers
 from cloud_manager.handlers.admin import *
@@ -25,7 +25,11 @@ def get_map() -> list[tuple[str, Type[BaseHandler]]]:
 
     routes = []
     for name, obj in classes.items():
-        if issubclass(obj, BaseHandler) and not (obj is BaseHandler):
+        if issubclass(obj, BaseHandler) and obj not in (
+            BaseHandler,
+            StreamingHandler,
+            UploadHandler,
+        ):
             if not hasattr(obj, "ENDPOINT"):
                 raise RuntimeError(f"Class {name} has no ENDPOINT attribute")
 
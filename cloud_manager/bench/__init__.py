@@ -0,0 +1,6 @@
+"""
+Intecrate API Benchmarks
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
@@ -0,0 +1,5 @@
+from cloud_manager.bench.load import main
+
+# The hashing pool spawns its workers, which import this module again
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Intecrate API Auth Benchmark
+
+Simulates video playback through NGINX auth_request and counts the database
+round trips each checkAuth strategy costs:
+
+    python -m cloud_manager.bench.auth --key <api key>
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+
+import pymongo.monitoring
+
+import cloud_manager.common.settings as s
+import cloud_manager.datamodel as datamodel
+from cloud_manager.common.mongo_util import Database
+
+
+class CommandCounter(pymongo.monitoring.CommandListener):
+    """Counts every command sent to MongoDB"""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def started(self, event) -> None:
+        with self._lock:
+            self.count += 1
+
+    def succeeded(self, event) -> None:
+        ...
+
+    def failed(self, event) -> None:
+        ...
+
+
+async def baseline_check(db: Database, api_key: str) -> bool:
+    """The checkAuth path before any caching: an existence query, then the
+    full user document, deserialized into a User
+
+    Args:
+        db: The database to authenticate against
+        api_key: The key to check
+
+    Returns:
+        If the key belongs to a user
+    """
+
+    if not await db._key_exists(api_key):
+        return False
+
+    result = await db.users.find_one({"apiKey": api_key})
+    if result is None:
+        return False
+
+    result["id"] = str(result["_id"])
+    del result["_id"]
+    del result["passwordHash"]
+    db.try_deserialize(result, datamodel.User)
+    return True
+
+
+async def simulate(
+    db: Database,
+    counter: CommandCounter,
+    strategy: str,
+    api_key: str,
+    viewers: int,
+    minutes: float,
+    ranges_per_minute: int,
+) -> dict:
+    """Replays a playback session against one checkAuth strategy
+
+    Args:
+        db: The database to authenticate against
+        counter: The command counter registered with pymongo
+        strategy: One of "baseline", "in_process" or "nginx_cache"
+        api_key: The key every viewer authenticates with
+        viewers: The number of concurrent viewers
+        minutes: The simulated length of the session
+        ranges_per_minute: Range requests each viewer issues per minute
+
+    Returns:
+        The request, API call and round trip counts of the run
+    """
+
+    db.clear_auth_caches()
+
+    # Simulated timeline of (second, viewer) range requests
+    interval = 60 / ranges_per_minute
+    events = sorted(
+        (i * interval, viewer)
+        for viewer in range(viewers)
+        for i in range(int(minutes * ranges_per_minute))
+    )
+
+    cached_until: dict[str, float] = {}
+    api_calls = 0
+    start_count = counter.count
+    start = time.perf_counter()
+
+    for second, _ in events:
+        if strategy == "baseline":
+            await baseline_check(db, api_key)
+            api_calls += 1
+
+        elif strategy == "in_process":
+            await db.key_is_valid(api_key)
+            api_calls += 1
+
+        elif strategy == "nginx_cache":
+            # NGINX only forwards once the cached decision expires
+            if second >= cached_until.get(api_key, -1):
+                await db.key_is_valid(api_key)
+                cached_until[api_key] = second + s.AUTH_ALLOW_TTL
+                api_calls += 1
+
+        else:
+            raise ValueError(f"Unknown strategy {strategy}")
+
+    return {
+        "strategy": strategy,
+        "requests": len(events),
+        "api_calls": api_calls,
+        "db_round_trips": counter.count - start_count,
+        "elapsed_s": round(time.perf_counter() - start, 4),
+    }
+
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    counter = CommandCounter()
+    pymongo.monitoring.register(counter)
+
+    db = Database.get_instance()
+
+    results = []
+    for strategy in ("baseline", "in_process", "nginx_cache"):
+        results.append(
+            await simulate(
+                db,
+                counter,
+                strategy,
+                api_key=args.key,
+                viewers=args.viewers,
+                minutes=args.minutes,
+                ranges_per_minute=args.ranges_per_minute,
+            )
+        )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--key",
+        default=os.environ.get("INTECRATE_TEST_USER_KEY"),
+        help="A valid api key (defaults to $INTECRATE_TEST_USER_KEY)",
+    )
+    parser.add_argument("--viewers", type=int, default=5)
+    parser.add_argument("--minutes", type=float, default=2)
+    parser.add_argument("--ranges-per-minute", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.key is None:
+        parser.error("an api key is required")
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
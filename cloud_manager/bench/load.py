@@ -0,0 +1,243 @@
+"""
+Intecrate API HTTP Load Benchmark
+
+Serves the Application in-process on an ephemeral port, backed by the memory
+database, and drives it with AsyncHTTPClient. Measures the framework
+(prepare, inner_wrapper, respond) without any network or Mongo latency:
+
+    python -m cloud_manager.bench --concurrency 16 --duration 10
+
+The client shares the process and IOLoop with the server, so throughput is a
+relative measure between builds, not a capacity estimate.
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Optional
+
+import tornado.httpclient
+import tornado.httpserver
+import tornado.testing
+
+import cloud_manager.common.settings as s
+from cloud_manager.common.mongo_util import Database
+from cloud_manager.webserver import Application
+
+
+class Scenario:
+    """A request to send repeatedly, and the status it should get"""
+
+    def __init__(
+        self,
+        name: str,
+        path: str,
+        method: str = "GET",
+        body: Optional[dict] = None,
+        authenticated: bool = False,
+        expected_status: int = 200,
+    ) -> None:
+        self.name = name
+        self.path = path
+        self.method = method
+        self.body = json.dumps(body).encode("utf-8") if body is not None else None
+        self.authenticated = authenticated
+        self.expected_status = expected_status
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in [
+        Scenario(
+            "benchmark",
+            "/benchmark",
+            method="POST",
+            body={"anAttribute": "load test"},
+        ),
+        Scenario(
+            "recursive_benchmark",
+            "/recursiveBenchmark",
+            method="POST",
+            body={"anAttribute": "load test"},
+        ),
+        Scenario("whoami", "/util/whoami", authenticated=True),
+        Scenario("challenge_list", "/challenge/list", authenticated=True),
+        Scenario("unauthenticated", "/util/whoami", expected_status=403),
+        Scenario(
+            "bad_request",
+            "/benchmark",
+            method="POST",
+            body={"anAttribute": 5},
+            expected_status=400,
+        ),
+    ]
+}
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    """Gets a percentile of sorted values by the nearest rank method"""
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def seed(db: Database) -> str:
+    """Creates a user with a few challenges in the memory database
+
+    Returns:
+        The api key of the user
+    """
+
+    api_key = "bench-user-key"
+    user = await db.add_user(
+        name="bench",
+        email="bench@example.com",
+        birthday="2000-01-01",
+        password_hash="not a real hash",
+        api_key=api_key,
+    )
+    for i in range(5):
+        challenge = await db.create_challenge(f"bench challenge {i}", "", "")
+        await db.attach_challenge(user.id, challenge.id)
+    return api_key
+
+
+async def drive(
+    client: tornado.httpclient.AsyncHTTPClient,
+    url: str,
+    scenario: Scenario,
+    api_key: str,
+    concurrency: int,
+    duration: float,
+) -> dict:
+    """Sends a scenario's request from concurrent loops for a while
+
+    Args:
+        client: The client to send with
+        url: The base url of the server
+        scenario: The request to send
+        api_key: The key of the seeded user
+        concurrency: The number of requests in flight at once
+        duration: Seconds to keep sending for
+
+    Returns:
+        The throughput and latency percentiles of the run
+    """
+
+    headers = {}
+    if scenario.body is not None:
+        headers["Content-Type"] = "application/json"
+    if scenario.authenticated:
+        headers["Authorization"] = api_key
+
+    latencies: list[float] = []
+    unexpected: dict[int, int] = {}
+    deadline = time.perf_counter() + duration
+
+    async def loop() -> None:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.fetch(
+                url + scenario.path,
+                method=scenario.method,
+                body=scenario.body,
+                headers=headers,
+                raise_error=False,
+            )
+            latencies.append(time.perf_counter() - start)
+            if response.code != scenario.expected_status:
+                unexpected[response.code] = unexpected.get(response.code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "scenario": scenario.name,
+        "requests": len(latencies),
+        "unexpected_statuses": unexpected,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    db = Database.get_instance(backend="memory")
+    api_key = await seed(db)
+    if s.CATALOG_CACHE:
+        await db.load_catalog()
+
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(Application())
+    server.add_sockets([sock])
+    url = f"http://127.0.0.1:{port}"
+
+    tornado.httpclient.AsyncHTTPClient.configure(None, max_clients=args.concurrency)
+    client = tornado.httpclient.AsyncHTTPClient()
+
+    results = []
+    try:
+        for name in args.scenarios:
+            scenario = SCENARIOS[name]
+            if args.warmup > 0:
+                await drive(
+                    client, url, scenario, api_key, args.concurrency, args.warmup
+                )
+            results.append(
+                await drive(
+                    client, url, scenario, api_key, args.concurrency, args.duration
+                )
+            )
+    finally:
+        client.close()
+        server.stop()
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        choices=list(SCENARIOS),
+        default=list(SCENARIOS),
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds each")
+    parser.add_argument("--warmup", type=float, default=1, help="Seconds each")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument(
+        "--log-level",
+        choices=list(s.LOG_LEVELS),
+        default="error",
+        help="Server log level during the run",
+    )
+    args = parser.parse_args()
+
+    # Request logging would otherwise dominate what is being measured
+    s.LOG_LEVEL = args.log_level
+    logging.getLogger("tornado.access").setLevel(logging.ERROR)
+
+    results = asyncio.run(run(args))
+
+    report = json.dumps(results, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Intecrate API Serialization Benchmark
+
+Times validating, dumping and JSON encoding the models that are serialized on
+every response, for fixtures of several sizes:
+
+    python -m cloud_manager.bench.serialization
+
+Results are saved per pydantic version, and compared against the results of
+every other version found in the results directory.
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
+
+from __future__ import annotations
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import time
+from typing import Callable
+
+import pydantic
+
+from cloud_manager import datamodel
+from cloud_manager.common.mongo_util import Database
+
+USER_SIZES = [1, 10, 100, 500]
+STEP_SIZES = [0, 10, 50, 200]
+
+
+def user_document(challenges: int) -> dict:
+    """Builds a user as it is stored, with a number of active challenges"""
+    return {
+        "id": "656a3cde4e0e6b2f6a1d0a11",
+        "name": "johndoe",
+        "birthday": "2023-08-04T18:10:04.956728",
+        "email": "johndoe@example.com",
+        "apiKey": "d6c5f1a2-5a4e-4bb4-9c7d-0c1f8e7b2a33",
+        "challenges": [
+            {
+                "challengeId": f"656a3cde4e0e6b2f6a1d{i:04x}",
+                "challengeProgress": {
+                    "startedDate": "2023-11-30T10:00:00.000000",
+                    "currentStep": f"656a3cde4e0e6b2f6a1e{i:04x}" if i % 2 else None,
+                    "lastWorkedOn": "2023-12-01T16:30:00.000000",
+                },
+            }
+            for i in range(challenges)
+        ],
+    }
+
+
+def step_document(resources: int) -> dict:
+    """Builds a step as it is stored, with a number of help resources"""
+    return {
+        "id": "656a3cde4e0e6b2f6a1e0001",
+        "challengeId": "656a3cde4e0e6b2f6a1d0001",
+        "videoPath": "challenges/656a3cde4e0e6b2f6a1d0001/steps/1/main.mp4",
+        "stepName": "Sketch the base profile",
+        "helpResources": [
+            {
+                "prompt": f"Stuck on part {i}? Watch this walkthrough.",
+                "resourceType": "VIDEO" if i % 2 else "MARKDOWN",
+                "resourcePath": f"resources/{i}/content",
+                "resourceId": f"0d86e77b-b792-4db2-b31e-{i:012x}",
+            }
+            for i in range(resources)
+        ],
+    }
+
+
+def measure(fn: Callable[[], object], min_time: float) -> dict:
+    """Times a function over enough runs to fill min_time, in microseconds
+
+    Returns:
+        The median and best time per call
+    """
+
+    # Calibrate the number of calls per sample to about 1/20 of min_time
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        if time.perf_counter() - start >= min_time / 20:
+            break
+        calls *= 2
+
+    samples = []
+    for _ in range(20):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        samples.append((time.perf_counter() - start) / calls * 1e6)
+
+    return {
+        "median_us": round(statistics.median(samples), 3),
+        "min_us": round(min(samples), 3),
+    }
+
+
+def cases(
+    name: str, model: type[datamodel.BaseModel], document: dict
+) -> dict[str, Callable[[], object]]:
+    """Builds the operations to time for one fixture"""
+
+    instance = model.model_validate(document)
+    dumped = instance.model_dump(by_alias=True)
+
+    return {
+        f"{name}/model_validate": lambda: model.model_validate(document),
+        f"{name}/model_dump": lambda: instance.model_dump(by_alias=True),
+        f"{name}/json_dumps": lambda: json.dumps(dumped),
+        f"{name}/model_dump_json": lambda: instance.model_dump_json(by_alias=True),
+        f"{name}/try_deserialize": lambda: Database.try_deserialize(document, model),
+    }
+
+
+def run(min_time: float) -> dict[str, dict]:
+    timed = {}
+    for size in USER_SIZES:
+        timed.update(cases(f"user[{size}]", datamodel.User, user_document(size)))
+    for size in STEP_SIZES:
+        timed.update(cases(f"step[{size}]", datamodel.Step, step_document(size)))
+
+    return {case: measure(fn, min_time) for case, fn in timed.items()}
+
+
+def compare(results: dict[str, dict], results_dir: str, current: str) -> None:
+    """Prints the median ratio of this run against each saved version"""
+
+    for path in sorted(glob.glob(os.path.join(results_dir, "serialization-*.json"))):
+        if os.path.abspath(path) == os.path.abspath(current):
+            continue
+
+        with open(path, "r") as f:
+            previous = json.load(f)
+
+        print(f"\nvs pydantic {previous['pydantic']} ({path}):")
+        for case, timing in results.items():
+            before = previous["results"].get(case)
+            if before is None:
+                continue
+            ratio = timing["median_us"] / before["median_us"]
+            print(f"  {case:<32} {ratio:6.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.5,
+        help="Seconds to spend timing each case",
+    )
+    parser.add_argument("--results-dir", default="bench_results")
+    args = parser.parse_args()
+
+    results = run(args.min_time)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(
+        args.results_dir, f"serialization-pydantic-{pydantic.VERSION}.json"
+    )
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "pydantic": pydantic.VERSION,
+                "python": platform.python_version(),
+                "recorded": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+
+    print(json.dumps(results, indent=2))
+    print(f"\nsaved to {path}")
+
+    compare(results, args.results_dir, path)
+
+
+if __name__ == "__main__":
+    main()
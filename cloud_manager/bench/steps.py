@@ -0,0 +1,145 @@
+"""
+Intecrate API Step Listing Benchmark
+
+Compares fetching a challenge's steps one query per id against the batched
+get_steps_many, for challenges of several sizes:
+
+    python -m cloud_manager.bench.steps --sizes 10 100 1000
+
+Pass --backend memory to run without Atlas; db_memory_latency_ms in
+global_config.json sets its simulated round trip.
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Awaitable, Callable
+
+from bson.objectid import ObjectId
+
+from cloud_manager import datamodel
+from cloud_manager.common.mongo_util import Database, count_queries
+
+
+async def make_fixture(db: Database, size: int) -> datamodel.Challenge:
+    """Creates a throwaway challenge with the given number of steps
+
+    Args:
+        db: The database to create the fixture in
+        size: The number of steps to attach
+
+    Returns:
+        The challenge, with its steps attached
+    """
+
+    challenge = await db.create_challenge(
+        f"benchmark ({size} steps)", "temporary benchmark fixture", ""
+    )
+
+    documents = [
+        datamodel.Step(
+            id="tmp",
+            challengeId=challenge.id,
+            videoPath="bench/main.mp4",
+            stepName=f"step {i}",
+            helpResources=[],
+        ).model_dump(by_alias=True, exclude={"id"})
+        for i in range(size)
+    ]
+    result = await db.steps.insert_many(documents)
+    step_ids = [str(i) for i in result.inserted_ids]
+
+    # Written directly; set_challenge_steps validates each step one by one
+    await db.challenges.update_one(
+        {"_id": ObjectId(challenge.id)}, {"$set": {"steps": step_ids}}
+    )
+    challenge.steps = step_ids
+
+    return challenge
+
+
+async def remove_fixture(db: Database, challenge: datamodel.Challenge) -> None:
+    """Deletes a fixture made by make_fixture"""
+    await db.steps.delete_many({"challengeId": challenge.id})
+    await db.challenges.delete_one({"_id": ObjectId(challenge.id)})
+
+
+async def measure(
+    fetch: Callable[[], Awaitable[list[datamodel.Step]]], repeat: int
+) -> dict:
+    """Times a step fetching strategy
+
+    Args:
+        fetch: Fetches every step of the fixture
+        repeat: The number of times to run it
+
+    Returns:
+        The latency and query count of the strategy
+    """
+
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        counter = count_queries()
+        start = time.perf_counter()
+        await fetch()
+        timings.append(time.perf_counter() - start)
+        queries = counter.count
+
+    return {
+        "queries": queries,
+        "mean_ms": round(statistics.mean(timings) * 1000, 3),
+        "min_ms": round(min(timings) * 1000, 3),
+    }
+
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    db = Database.get_instance(backend=args.backend)
+
+    results = []
+    for size in args.sizes:
+        challenge = await make_fixture(db, size)
+
+        async def sequential() -> list[datamodel.Step]:
+            return [await db.get_step_strict(s) for s in challenge.steps]
+
+        async def batched() -> list[datamodel.Step]:
+            return await db.get_steps_many_strict(challenge.steps)
+
+        try:
+            results.append(
+                {
+                    "steps": size,
+                    "sequential": await measure(sequential, args.repeat),
+                    "batched": await measure(batched, args.repeat),
+                }
+            )
+        finally:
+            await remove_fixture(db, challenge)
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--backend",
+        choices=["mongo", "memory"],
+        help="Defaults to the db_backend setting",
+    )
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,30 +7,101 @@ Licensing Information found at: https://intecrate.co/legal/license
 
 from __future__ import annotations
 import functools
-from pprint import pprint
-from pydantic import ValidationError
+import hashlib
+from pydantic import TypeAdapter, ValidationError
 import tornado.web
 import tornado.httpserver
-from cloud_manager.common.tools import log
+import tornado.netutil
+import tornado.process
+from cloud_manager.common.tools import log, log_enabled, truncate
+from cloud_manager.common.log_writer import LogWriter
 import cloud_manager.datamodel as datamodel
 from cloud_manager.datamodel import HttpMethod
 import cloud_manager.common.settings as s
 import cloud_manager.common.mongo_util as mongo_util
+from cloud_manager.common.metrics import Metrics
+from cloud_manager.common.resumable import UploadSessions
+from cloud_manager.common.upload import MultipartUpload
 from tornado.httputil import parse_multipart_form_data
 
 import os
-from typing import Any, Awaitable, Callable, Optional, Union
-import json
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Union
 
 from cloud_manager.error import (
     AuthenticationError,
     CloudManagerError,
+    DatabaseError,
+    FileManagerError,
     InternalError,
     RequestError,
 )
 
 use_https = False
 
+HTTP_LATENCY = Metrics.get_instance().histogram(
+    "intecrate_http_request_duration_seconds",
+    "Time spent handling API requests; _count is the number of requests",
+)
+HTTP_IN_FLIGHT = Metrics.get_instance().gauge(
+    "intecrate_http_requests_in_flight", "API requests currently being handled"
+)
+HTTP_ERRORS = Metrics.get_instance().counter(
+    "intecrate_http_errors_total", "Error responses by CloudManagerError class"
+)
+
+
+class Principal:
+    """The caller of a request. Resolved once per request so handlers do not
+    look the API key up again.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        admin: bool,
+        user: Optional[datamodel.User] = None,
+    ) -> None:
+        """
+        Args:
+            api_key: The api key of the request, if there is one
+            admin: If the api key belongs to an admin
+            user: The user that owns the api key, if it has been resolved
+        """
+        self.api_key = api_key
+        self.admin = admin
+        self.user = user
+
+    def require_user(self) -> datamodel.User:
+        """Gets the user behind the request
+
+        Returns:
+            The resolved user
+
+        Raises:
+            AuthenticationError if the request has no resolved user
+        """
+        if self.user is None:
+            raise AuthenticationError("This endpoint requires login")
+        return self.user
+
+
+@functools.lru_cache(maxsize=None)
+def response_adapter(model: type[datamodel.BaseModel]) -> TypeAdapter:
+    """Gets the cached serializer of a response model
+
+    Args:
+        model: The model class
+
+    Returns:
+        An adapter whose dump_json writes the model to JSON bytes
+    """
+    return TypeAdapter(model)
+
 
 class BaseHandler(tornado.web.RequestHandler):
     """
@@ -40,27 +111,85 @@ class BaseHandler(tornado.web.RequestHandler):
     EXPECTED_REQUEST = None
     EXPECTED_RESPONSE = None
 
+    principal: Principal
+
     async def prepare(self) -> None:
         """Runs at the beginning of each request handle"""
-        log(
-            f"--- Got API request ---\n"
-            f"\t  - protocol: {self.request.protocol}\n"
-            f"\t  - host: {self.request.host}\n"
-            f"\t  - path: {self.request.path}\n"
-            f"\t  - method: {self.request.method}\n"
-            f"\t  - admin: {await self.is_admin()}\n"
-            f"\t  - api key: {await self.get_api_key()}\n"
-            f"\t  - body: {self.request.body}"
-            "\n"
-        )
+        log("%s %s", self.request.method, self.request.path)
+
+        self.queries = mongo_util.count_queries()
+
+        # Resolved from headers only; inner_wrapper looks up the user if needed
+        api_key = await self.get_api_key()
+        self.principal = Principal(api_key=api_key, admin=await self.is_admin())
+
+        # Only build the full request dump when it will be written
+        if log_enabled("debug"):
+            log(
+                "--- Got API request ---\n"
+                "\t  - protocol: %s\n"
+                "\t  - host: %s\n"
+                "\t  - path: %s\n"
+                "\t  - method: %s\n"
+                "\t  - admin: %s\n"
+                "\t  - api key: %s\n"
+                "\t  - body: %s"
+                "\n",
+                self.request.protocol,
+                self.request.host,
+                self.request.path,
+                self.request.method,
+                self.principal.admin,
+                self.principal.api_key,
+                self.loggable_body(),
+                status="debug",
+            )
+
+    def loggable_body(self) -> str:
+        """Gets the request body for logging, capped at LOG_BODY_MAX_BYTES and
+        sampled at LOG_BODY_SAMPLE_RATE
+
+        Returns:
+            The (possibly truncated) body, or a placeholder if not sampled
+        """
+        body = self.request.body
+        if not body:
+            return "<empty>"
+        if random.random() >= s.LOG_BODY_SAMPLE_RATE:
+            return f"<{len(body)} bytes, not sampled>"
+        return truncate(body, s.LOG_BODY_MAX_BYTES)
+
+    async def resolve_user(self) -> datamodel.User:
+        """Looks up the user behind the request's api key and stores it on the
+        principal. Only queries the database the first time.
+
+        Returns:
+            The user that owns the api key
+
+        Raises:
+            AuthenticationError if there is no key, or it belongs to no user
+        """
 
-        if "Content-Type" in self.request.headers:
-            content_type = self.request.headers["Content-Type"]
-            print(f"Got request with Content-Type: {content_type}")
-            if content_type == "application/json":
-                print("loading as json")
-                self.args = json.loads(self.request.body)
-                print(f"Loaded to {self.args}")
+        if self.principal.user is not None:
+            return self.principal.user
+
+        key = await self.get_api_key_strict()
+        try:
+            self.principal.user = await self.db.user_by_key(key)
+        except DatabaseError:
+            raise AuthenticationError("This endpoint requires login")
+
+        return self.principal.user
+
+    def on_finish(self) -> None:
+        queries = getattr(self, "queries", None)
+        if queries is not None:
+            log(
+                "%s made %d database queries",
+                self.request.path,
+                queries.count,
+                status="debug",
+            )
 
     async def get_api_key(self) -> Optional[str]:
         """Get the API key of the request, if there is one
@@ -114,17 +243,22 @@ class BaseHandler(tornado.web.RequestHandler):
 
     def write_error(self, status_code: int, message: str = "None", **kwargs) -> None:
         """Writes error with status"""
-        log(f"API Raised Error {status_code}: {message}", "error")
+        log(f"API Raised Error {status_code}: {message}", status="error")
         super().write_error(status_code, **kwargs)
 
     def write(self, chunk) -> None:
         """Writes a chunk of information"""
-        log(f"(Final) Writing: {chunk}")
+        if log_enabled("debug"):
+            log(
+                "(Final) Writing: %s",
+                truncate(chunk, s.LOG_BODY_MAX_BYTES),
+                status="debug",
+            )
         super().write(chunk)
 
     async def get_current_user(self) -> Optional[bytes]:
         """Gets the current user's cookie"""
-        log("use of deprecated method 'get_current_user'", "warn")
+        log("use of deprecated method 'get_current_user'", status="warn")
         return self.get_signed_cookie("user")
 
     async def options(self, *args) -> None:
@@ -135,7 +269,7 @@ class BaseHandler(tornado.web.RequestHandler):
     def set_default_headers(self):
         """Sets default headers to allow cross-origin access"""
         self.set_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-        self.set_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.set_header("Access-Control-Allow-Methods", "GET, POST, PUT, OPTIONS")
         self.set_header("Access-Control-Allow-Origin", "*")
 
     async def respond(
@@ -153,7 +287,10 @@ class BaseHandler(tornado.web.RequestHandler):
         EXPECTED_RESPONSE = getattr(self, "EXPECTED_RESPONSE", None)
 
         if EXPECTED_RESPONSE is None:
-            log(f"{type(self).__name__} has no EXPECTED_RESPONSE attribute", "error")
+            log(
+                f"{type(self).__name__} has no EXPECTED_RESPONSE attribute",
+                status="error",
+            )
             raise Exception(f"{type(self).__name__} has no EXPECTED_RESPONSE attribute")
 
         if isinstance(obj, datamodel.ResponseContainer):
@@ -161,14 +298,69 @@ class BaseHandler(tornado.web.RequestHandler):
         else:
             model = obj
 
-        serialized = model.model_dump(by_alias=True)
-
-        assert isinstance(serialized, dict), f"object failed to serialize: {serialized}"
+        # Serialized once, straight to bytes; Tornado would json.dumps a dict
+        body = response_adapter(type(model)).dump_json(model, by_alias=True)
 
         if status_code is not None:
             self.set_status(status_code)
 
-        self.write(model.model_dump(by_alias=True))
+        queries = getattr(self, "queries", None)
+        if s.QUERY_COUNT_HEADER and queries is not None:
+            self.set_header("X-Db-Queries", str(queries.count))
+
+        # Strong ETag from the payload, unless a version ETag was already set
+        if self.request.method == "GET" and self.get_status() == 200:
+            if "Etag" not in self._headers:
+                digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+                self.set_header("ETag", f'"{digest}"')
+            if self.check_etag_header():
+                self.set_status(304)
+                return
+
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.write(body)
+
+    def version_tags(self) -> Optional[List[str]]:
+        """The Database version tags a GET response depends on. Handlers that
+        return tags can answer 304 before doing any work.
+
+        Returns:
+            The tags (see Database.version_etag), or None to only use an ETag
+            of the serialized payload
+        """
+        return None
+
+    def check_version_etag(self) -> bool:
+        """Sets the version ETag of a GET response, if the handler has one,
+        and checks it against If-None-Match
+
+        Returns:
+            True if the client's copy is current; the response is then a 304
+        """
+        if not s.VERSION_ETAGS:
+            return False
+
+        tags = self.version_tags()
+        if tags is None:
+            return False
+
+        self.set_header("ETag", self.db.version_etag(tags))
+        if self.check_etag_header():
+            self.set_status(304)
+            return True
+        return False
+
+    async def respond_error(self, error: CloudManagerError) -> None:
+        """Responds with an error model, counting it by error class
+
+        Args:
+            error: The error to respond with
+        """
+        HTTP_ERRORS.inc(
+            endpoint=getattr(self, "ENDPOINT", self.request.path),
+            error=type(error).__name__,
+        )
+        await self.respond(error.model, error.code)
 
     async def post(self, *args, **kwargs):
         super().post()
@@ -178,6 +370,132 @@ class BaseHandler(tornado.web.RequestHandler):
         return mongo_util.Database.get_instance(testmode=self.settings["testmode"])
 
 
+@tornado.web.stream_request_body
+class StreamingHandler(BaseHandler):
+    """
+    Base of admin handlers whose request body is streamed instead of
+    buffered. Admin access is checked and start_stream is called before any of
+    the body is read; the body is then passed to data_received as it arrives,
+    up to UPLOAD_MAX_BYTES.
+    """
+
+    async def prepare(self) -> None:
+        await super().prepare()
+
+        # Checked before the body is read, not only in the api decorators
+        try:
+            await self.assert_admin()
+            await self.start_stream()
+        except CloudManagerError as e:
+            await self.respond_error(e)
+            self.finish()
+            return
+
+        self.request.connection.set_max_body_size(s.UPLOAD_MAX_BYTES)
+
+    async def start_stream(self) -> None:
+        """Gets ready for the body, from the request line and headers
+
+        Raises:
+            CloudManagerError to reject the request before its body is read
+        """
+
+    def loggable_body(self) -> str:
+        length = self.request.headers.get("Content-Length", "unknown")
+        return f"<streamed upload, {length} bytes>"
+
+
+class UploadHandler(StreamingHandler):
+    """
+    Base of admin handlers that take a multipart/form-data upload.
+
+    The body is streamed instead of buffered: file parts are written to temp
+    files under UPLOAD_DIR and hashed as they arrive, so memory use does not
+    depend on the upload size. Handlers use api_post as usual; their
+    EXPECTED_REQUEST is built from the text fields, and the files are in
+    self.upload.files. A "<field>Sha256" text field is checked against the
+    digest of that file. Temp files that the handler did not move away are
+    removed when the request ends.
+    """
+
+    # File field -> the extensions it accepts. Every file field is required
+    FILE_FIELDS: dict[str, set[str]] = {}
+
+    upload: Optional[MultipartUpload] = None
+    upload_error: Optional[CloudManagerError] = None
+
+    async def start_stream(self) -> None:
+        self.upload = MultipartUpload.from_content_type(
+            self.request.headers.get("Content-Type", ""),
+            s.UPLOAD_DIR,
+            self.FILE_FIELDS,
+        )
+
+    def data_received(self, chunk: bytes) -> None:
+        if self.upload is None or self.upload_error is not None:
+            return
+
+        try:
+            self.upload.feed(chunk)
+        except CloudManagerError as e:
+            self.upload_error = e
+        except OSError as e:
+            self.upload_error = FileManagerError(f"Failed to write upload: {e}")
+
+        # The rest of the body is read and ignored; the error is sent after
+        if self.upload_error is not None:
+            self.upload.discard()
+
+    def upload_request(self, model: type[datamodel.BaseModel]) -> datamodel.BaseModel:
+        """Builds the request model from the text fields of the finished upload
+
+        Args:
+            model: The EXPECTED_REQUEST of the handler
+
+        Returns:
+            The request
+
+        Raises:
+            The error that stopped the upload, RequestError if the upload is
+            incomplete or a file does not match its digest, or ValidationError
+        """
+
+        if self.upload_error is not None:
+            raise self.upload_error
+        assert self.upload is not None, "upload was not started"
+
+        self.upload.finish()
+
+        for file in self.upload.files.values():
+            expected = self.upload.fields.get(f"{file.field}Sha256")
+            if expected is not None and expected.lower() != file.sha256:
+                raise RequestError(
+                    message=f"{file.filename} does not match its sha256 digest"
+                )
+            log(
+                "received %s as '%s' (%d bytes, sha256 %s)",
+                file.filename,
+                file.field,
+                file.size,
+                file.sha256,
+                status="debug",
+            )
+
+        return model.model_validate(self.upload.fields)
+
+    def discard_upload(self) -> None:
+        if self.upload is not None:
+            self.upload.discard()
+
+    def on_finish(self) -> None:
+        super().on_finish()
+        self.discard_upload()
+
+    def on_connection_close(self) -> None:
+        super().on_connection_close()
+        self.discard_upload()
+
+
 def api_post(requires_admin: bool = False, requires_login: bool = False):
     """
     A decorator that allows post methods to be handled via datamodel objects.
@@ -198,6 +516,18 @@ def api_get(requires_admin: bool = False, requires_login: bool = False):
     )
 
 
+def api_put(requires_admin: bool = False, requires_login: bool = False):
+    """
+    A decorator that allows put methods to be handled via datamodel objects.
+    The body is not parsed; put handlers are StreamingHandlers that consume it
+    as it arrives.
+    """
+
+    return lambda x: inner_wrapper(
+        x, HttpMethod.PUT, requires_admin=requires_admin, requires_login=requires_login
+    )
+
+
 def api_delete(requires_admin: bool = False, requires_login: bool = False):
     """
     A decorator that allows post methods to be handled via datamodel objects.
@@ -223,7 +553,7 @@ def inner_wrapper(
         func: The handler function
         method:"""
 
-    async def wrapper(self: BaseHandler, *args, **kwargs):
+    async def handle(self: BaseHandler):
         request_object: Optional[BaseHandler]
 
         # Check authentication before processing request
@@ -231,72 +561,81 @@ def inner_wrapper(
             try:
                 await self.assert_admin()
             except AuthenticationError as e:
-                await self.respond(e.model, e.code)
+                await self.respond_error(e)
                 return
         if requires_login:
             try:
-                key = await self.get_api_key_strict()
-                await self.db.user_by_key(key)
-            except CloudManagerError as e:
-                await self.respond(
-                    AuthenticationError("This endpoint requires login").model
-                )
+                await self.resolve_user()
+            except AuthenticationError as e:
+                await self.respond_error(e)
                 return
 
         # Prepare request
-        log(f"Preparing request for {self.__class__.__name__}")
+        log("Preparing request for %s", self.__class__.__name__, status="debug")
         if method in (HttpMethod.POST, HttpMethod.DELETE):
             # Find EXPECTED_REQUEST
             EXPECTED_REQUEST = self.EXPECTED_REQUEST
             if EXPECTED_REQUEST is None:
-                await self.respond(
+                await self.respond_error(
                     InternalError(
                         message=f"Handler class {self.__class__.__name__} has no EXPECTED_REQUEST",
                         operation="Handler wrapper",
-                    ).model,
-                    500,
+                    )
                 )
                 return
             if not issubclass(EXPECTED_REQUEST, datamodel.BaseModel):
-                await self.respond(
+                await self.respond_error(
                     InternalError(
                         message=f"Handler class {self.__class__.__name__} has invalid EXPECTED_REQUEST: '{EXPECTED_REQUEST}'",
                         operation="Handler wrapper",
-                    ).model,
-                    500,
+                    )
                 )
                 return
 
-            # Deserialize request
-            log("loading request_object", "debug")
+            # Parse and validate the raw body in one pass; malformed JSON is a
+            # ValidationError too. Streamed uploads were parsed as they arrived
             try:
-                request_object = EXPECTED_REQUEST(**self.args)  # <-- The POST payload
+                if isinstance(self, UploadHandler):
+                    request_object = self.upload_request(EXPECTED_REQUEST)
+                else:
+                    request_object = EXPECTED_REQUEST.model_validate_json(
+                        self.request.body
+                    )
+            except CloudManagerError as e:
+                await self.respond_error(e)
+                return
             except ValidationError as e:
-                await self.respond(
+                await self.respond_error(
                     RequestError(
                         message=f"Bad request format for {EXPECTED_REQUEST.__name__}"
-                    ).model,
-                    400,
+                    )
                 )
                 return
 
-            print(f"Parsed request into {type(request_object).__name__}:")
-            pprint(request_object.model_dump())
-
         elif method == HttpMethod.GET:
             request_object = None
 
+            if self.check_version_etag():
+                return
+
+        elif method == HttpMethod.PUT:
+            # The body was already handed to data_received
+            request_object = None
+
         else:
-            await self.respond(
+            await self.respond_error(
                 InternalError(
                     message=f"Unknown method {method}", operation="Handler wrapper"
-                ).model
+                )
             )
             return
 
         # Execute handler
         log(
-            f"Routing request to {self.__class__.__name__} with input: {request_object}"
+            "Routing request to %s with input: %s",
+            self.__class__.__name__,
+            request_object,
+            status="debug",
         )
         try:
             if request_object is None:
@@ -304,39 +643,60 @@ def inner_wrapper(
             else:
                 response = await func(self, request_object)
         except CloudManagerError as e:
-            await self.respond(e.model, e.code)
+            await self.respond_error(e)
             return
         except Exception as e:
-            await self.respond(
+            await self.respond_error(
                 InternalError(
                     f"{self.__class__.__name__} raised unhandled error",
                     operation="Handler wrapper",
                     child_error=e,
-                ).model,
-                500,
+                )
             )
             return
 
         # Validate response
         if not isinstance(response, datamodel.BaseModel):
-            await self.respond(
+            await self.respond_error(
                 InternalError(
                     message=f"{func.__name__} returned illegal type {type(response).__name__}",
                     operation="Handler Wrapper",
-                ).model,
-                500,
+                )
             )
         else:
             await self.respond(response)
 
+    async def wrapper(self: BaseHandler, *args, **kwargs):
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await handle(self)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            HTTP_LATENCY.observe(
+                time.perf_counter() - start,
+                endpoint=getattr(self, "ENDPOINT", self.request.path),
+                method=method.value,
+                status=self.get_status(),
+            )
+
     return wrapper
 
 
 def host(
     application: tornado.web.Application,
     http_port: int,
+    workers: Optional[int] = None,
     # https_port: Optional[int] = None,
 ) -> None:
+    """Serves the application until the process is stopped
+
+    Args:
+        application: The application to serve
+        http_port: The port to listen on
+        workers: The number of worker processes sharing the port. 0 starts one
+            per CPU. Defaults to s.WORKERS
+    """
     # Move to this file's directory
     os.chdir(os.path.abspath(os.path.dirname(__file__)))
 
@@ -345,9 +705,55 @@ def host(
     # if https_port is not None:
     #     use_https = True
 
+    if workers is None:
+        workers = s.WORKERS
+
     # if http_port:
-    application.listen(http_port)
-    log(f"HTTP listening on port {http_port}")
+    if workers == 1:
+        application.listen(http_port)
+        log(f"HTTP listening on port {http_port}")
+    else:
+        # Bind before forking so every worker accepts on the same socket. The
+        # parent stays behind and restarts workers that crash.
+        sockets = tornado.netutil.bind_sockets(
+            http_port, reuse_port=hasattr(socket, "SO_REUSEPORT")
+        )
+        task_id = tornado.process.fork_processes(
+            workers, max_restarts=s.WORKER_MAX_RESTARTS
+        )
+        LogWriter.worker_id = task_id
+
+        server = tornado.httpserver.HTTPServer(application)
+        server.add_sockets(sockets)
+        log(f"HTTP worker {task_id} (pid {os.getpid()}) listening on port {http_port}")
+
+        # Workers are not told when the parent dies; stop once orphaned
+        parent = os.getppid()
+
+        def check_parent() -> None:
+            if os.getppid() != parent:
+                log(f"HTTP worker {task_id} orphaned; stopping", status="warn")
+                tornado.ioloop.IOLoop.current().stop()
+
+        tornado.ioloop.PeriodicCallback(check_parent, 1000).start()
+
+    # Warm up the database once the IOLoop is running
+    async def startup() -> None:
+        await mongo_util.Database.get_instance(
+            testmode=application.settings["testmode"]
+        ).startup()
+
+        # Every worker sweeps; sessions in use by another are skipped
+        if s.RESUMABLE_CLEANUP_INTERVAL > 0:
+            tornado.ioloop.PeriodicCallback(
+                UploadSessions.get_instance().remove_expired,
+                s.RESUMABLE_CLEANUP_INTERVAL * 1000,
+            ).start()
+
+    tornado.ioloop.IOLoop.current().add_callback(startup)
+
+    # Exit normally on SIGTERM so buffered logs are flushed at exit
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
     # if use_https:
     #     http_server = tornado.httpserver.HTTPServer(
@@ -0,0 +1,227 @@
+"""
+Intecrate API Cache
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
+
+from __future__ import annotations
+from collections import OrderedDict
+import hashlib
+import math
+import time
+from typing import Generic, Hashable, Iterable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """A bounded, in-process cache with least-recently-used eviction and
+    an optional time-to-live on each entry.
+
+    The cache is not thread safe; it is meant to be used from the IOLoop.
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None) -> None:
+        """
+        Args:
+            max_size: The maximum number of entries to hold
+            ttl: Seconds an entry stays valid for, or None to never expire
+        """
+
+        assert max_size > 0, "max_size must be positive"
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return self._lookup(key) is not None
+
+    def _lookup(self, key: K) -> Optional[tuple[float, V]]:
+        """Finds a live entry without touching the counters"""
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires, _ = entry
+        if self.ttl is not None and expires < time.monotonic():
+            del self._entries[key]
+            return None
+
+        return entry
+
+    def get(self, key: K) -> Optional[V]:
+        """Gets a value from the cache
+
+        Args:
+            key: The key to look up
+
+        Returns:
+            The cached value, or None if it is missing or expired
+        """
+
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: K, value: V) -> None:
+        """Adds or replaces a value in the cache
+
+        Args:
+            key: The key to store the value under
+            value: The value to store
+        """
+
+        expires = time.monotonic() + self.ttl if self.ttl is not None else 0.0
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: K) -> None:
+        """Removes a key from the cache, if it exists
+
+        Args:
+            key: The key to remove
+        """
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Removes every entry from the cache"""
+        self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        """Gets the hit/miss counters of the cache
+
+        Returns:
+            A dict of counter names to values
+        """
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class BloomFilter:
+    """A fixed-size set of strings that can answer "definitely absent" without
+    storing the strings themselves. Membership checks may return false
+    positives, but never false negatives.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001) -> None:
+        """
+        Args:
+            capacity: The number of items the filter is sized for
+            error_rate: The false positive rate at full capacity
+        """
+
+        assert capacity > 0, "capacity must be positive"
+        assert 0 < error_rate < 1, "error_rate must be between 0 and 1"
+
+        self.capacity = capacity
+        self.count = 0
+
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+
+        self._bits = bytearray((self.size + 7) // 8)
+
+    @classmethod
+    def from_items(cls, items: Iterable[str], error_rate: float = 0.001):
+        """Builds a filter sized with headroom for the given items
+
+        Args:
+            items: The strings to add to the filter
+            error_rate: The false positive rate at full capacity
+
+        Returns:
+            A filter containing every item
+        """
+        items = list(items)
+        bloom = cls(max(1024, len(items) * 2), error_rate)
+        for item in items:
+            bloom.add(item)
+        return bloom
+
+    def _positions(self, item: str) -> Iterable[int]:
+        """Derives the bit positions of an item using double hashing"""
+
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        """Adds an item to the filter
+
+        Args:
+            item: The string to add
+        """
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+def test():
+    """Tests the cache eviction and expiry. Used in static test"""
+
+    print("Testing LRU cache...")
+
+    cache: LRUCache[str, int] = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1, "failed to fetch cached value"
+
+    # "b" is now the least recently used entry
+    cache.put("c", 3)
+    assert cache.get("b") is None, "least recently used entry was not evicted"
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    cache.invalidate("a")
+    assert "a" not in cache, "failed to invalidate entry"
+
+    stats = cache.stats()
+    assert stats["hits"] == 3 and stats["misses"] == 1, f"bad counters {stats}"
+
+    print("Testing cache expiry...")
+
+    expiring: LRUCache[str, int] = LRUCache(max_size=2, ttl=0.01)
+    expiring.put("a", 1)
+    time.sleep(0.02)
+    assert expiring.get("a") is None, "expired entry was returned"
+
+    print("Testing bloom filter...")
+
+    bloom = BloomFilter.from_items(f"key-{i}" for i in range(500))
+    assert all(f"key-{i}" in bloom for i in range(500)), "bloom false negative"
+
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 100, f"too many false positives: {false_positives}"
+
+    print("success")
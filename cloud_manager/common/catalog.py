@@ -0,0 +1,226 @@
+"""
+Intecrate API Challenge Catalog
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
+
+from __future__ import annotations
+from typing import Iterable, Optional
+
+import cloud_manager.datamodel as datamodel
+
+
+class Catalog:
+    """Every challenge and step (with its help resources), held in process.
+
+    Entries are only changed through put/remove/load, so that each change
+    gets a version from a single counter that only goes up. Reads return
+    copies; callers are free to modify them. The catalog is not thread safe;
+    it is meant to be used from the IOLoop.
+    """
+
+    def __init__(self) -> None:
+        self.challenges: dict[str, datamodel.Challenge] = {}
+        self.steps: dict[str, datamodel.Step] = {}
+
+        # The version of the last change to the catalog
+        self.version = 0
+
+        # "challenge:<id>" or "step:<id>" -> the version of its last change.
+        # Removed entries keep their version until the next load
+        self._versions: dict[str, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.loaded = False
+
+    def _bump(self, key: str) -> int:
+        self.version += 1
+        self._versions[key] = self.version
+        return self.version
+
+    def entry_version(self, kind: str, id: str) -> int:
+        """Gets the version of the last change to an entry
+
+        Args:
+            kind: "challenge" or "step"
+            id: The id of the entry
+
+        Returns:
+            The version, or 0 if the entry has not been seen
+        """
+        return self._versions.get(f"{kind}:{id}", 0)
+
+    def get_challenge(self, challenge_id: str) -> Optional[datamodel.Challenge]:
+        """Gets a copy of a challenge
+
+        Args:
+            challenge_id: The id of the challenge
+
+        Returns:
+            The challenge, or None if it is not in the catalog
+        """
+        challenge = self.challenges.get(challenge_id)
+        if challenge is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return challenge.model_copy(deep=True)
+
+    def get_step(self, step_id: str) -> Optional[datamodel.Step]:
+        """Gets a copy of a step
+
+        Args:
+            step_id: The id of the step
+
+        Returns:
+            The step, or None if it is not in the catalog
+        """
+        step = self.steps.get(step_id)
+        if step is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return step.model_copy(deep=True)
+
+    def list_challenges(self) -> list[datamodel.Challenge]:
+        """Gets a copy of every challenge"""
+        self.hits += 1
+        return [c.model_copy(deep=True) for c in self.challenges.values()]
+
+    def put_challenge(
+        self, challenge: datamodel.Challenge, since: Optional[int] = None
+    ) -> None:
+        """Adds or replaces a challenge
+
+        Args:
+            challenge: The challenge, as read from the database
+            since: The catalog version when it was read. If the entry has
+                changed since, the older read is dropped
+        """
+        if since is not None and self.entry_version("challenge", challenge.id) > since:
+            return
+        self.challenges[challenge.id] = challenge.model_copy(deep=True)
+        self._bump(f"challenge:{challenge.id}")
+
+    def put_step(self, step: datamodel.Step, since: Optional[int] = None) -> None:
+        """Adds or replaces a step
+
+        Args:
+            step: The step, as read from the database
+            since: The catalog version when it was read. If the entry has
+                changed since, the older read is dropped
+        """
+        if since is not None and self.entry_version("step", step.id) > since:
+            return
+        self.steps[step.id] = step.model_copy(deep=True)
+        self._bump(f"step:{step.id}")
+
+    def remove_challenge(self, challenge_id: str) -> None:
+        self.challenges.pop(challenge_id, None)
+        self._bump(f"challenge:{challenge_id}")
+
+    def remove_step(self, step_id: str) -> None:
+        self.steps.pop(step_id, None)
+        self._bump(f"step:{step_id}")
+
+    def load(
+        self,
+        challenges: Iterable[datamodel.Challenge],
+        steps: Iterable[datamodel.Step],
+        since: int,
+    ) -> int:
+        """Replaces the catalog with a full snapshot of the database.
+
+        Entries changed after the snapshot was started are kept as they are,
+        since the snapshot may predate that change.
+
+        Args:
+            challenges: Every challenge in the database
+            steps: Every step in the database
+            since: The catalog version when the snapshot was started
+
+        Returns:
+            The number of entries the snapshot added, changed or removed
+        """
+
+        changed = 0
+        for kind, entries, snapshot in (
+            ("challenge", self.challenges, {c.id: c for c in challenges}),
+            ("step", self.steps, {s.id: s for s in steps}),
+        ):
+            for id in list(entries):
+                if id not in snapshot and self.entry_version(kind, id) <= since:
+                    del entries[id]
+                    self._bump(f"{kind}:{id}")
+                    changed += 1
+
+            for id, entry in snapshot.items():
+                if self.entry_version(kind, id) > since or entries.get(id) == entry:
+                    continue
+                entries[id] = entry
+                self._bump(f"{kind}:{id}")
+                changed += 1
+
+            # Forget removed entries that the snapshot agrees are gone
+            for key in [k for k in self._versions if k.startswith(f"{kind}:")]:
+                id = key[len(kind) + 1 :]
+                if id not in entries and id not in snapshot:
+                    if self._versions[key] <= since:
+                        del self._versions[key]
+
+        self.loaded = True
+        return changed
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self.challenges) + len(self.steps),
+            "hits": self.hits,
+            "misses": self.misses,
+            "version": self.version,
+        }
+
+
+def test():
+    """Tests catalog versions and snapshot loading. Used in static test"""
+
+    print("Testing catalog...")
+
+    def challenge(id: str, title: str = "title") -> datamodel.Challenge:
+        return datamodel.Challenge(
+            id=id, title=title, description="", coverImage="", steps=[]
+        )
+
+    catalog = Catalog()
+    catalog.load([challenge("a"), challenge("b")], [], since=0)
+    assert catalog.loaded and len(catalog.challenges) == 2
+
+    copy = catalog.get_challenge("a")
+    assert copy is not None
+    copy.steps.append("not saved")
+    assert catalog.challenges["a"].steps == [], "read did not return a copy"
+
+    before = catalog.entry_version("challenge", "a")
+    catalog.put_challenge(challenge("a", "renamed"))
+    assert catalog.entry_version("challenge", "a") > before, "version did not grow"
+
+    # "c" is created and "b" deleted while a snapshot without them is taken
+    since = catalog.version
+    catalog.put_challenge(challenge("c"))
+    catalog.remove_challenge("b")
+    catalog.load([challenge("a", "renamed"), challenge("b")], [], since=since)
+    assert "c" in catalog.challenges, "load dropped an entry newer than snapshot"
+    assert "b" not in catalog.challenges, "load restored a newer removal"
+
+    # A read that started before the last change is dropped
+    catalog.put_challenge(challenge("a", "stale"), since=before)
+    assert catalog.challenges["a"].title == "renamed", "stale read replaced entry"
+
+    # A later snapshot is authoritative
+    changed = catalog.load([challenge("a", "renamed")], [], catalog.version)
+    assert changed == 1 and list(catalog.challenges) == ["a"], catalog.challenges
+    assert catalog.get_challenge("missing") is None
+    assert catalog.stats()["misses"] == 1
+
+    print("success")
@@ -0,0 +1,751 @@
+"""
+Intecrate API Database Backends
+
+Database reads and writes through a backend's collections. MongoBackend talks
+to Atlas through Motor; MemoryBackend keeps everything in process, for tests
+and benchmarks that should not depend on the network.
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
+
+from __future__ import annotations
+import asyncio
+import copy
+from typing import Any, Iterable, Optional
+
+from bson.objectid import ObjectId
+import motor
+import pymongo
+import pymongo.errors
+import pymongo.results
+
+from cloud_manager.error import DatabaseError
+
+
+class MongoBackend:
+    """MongoDB Atlas, through Motor"""
+
+    def __init__(self, uri: str, **client_options) -> None:
+        """
+        Args:
+            uri: The connection string of the cluster
+            client_options: Passed to the MotorClient
+        """
+        self._client = motor.MotorClient(uri, **client_options)
+        self._client.get_io_loop = asyncio.get_running_loop
+
+        # TODO: Support multiple stages
+        self.db = self._client["Intecrate"]
+
+    def collection(self, name: str):
+        """Gets a Motor collection by name"""
+        return self.db[name]
+
+    async def command(self, command: str) -> dict:
+        """Runs an admin command, e.g. "ping" """
+        return await self._client.admin.command(command)
+
+
+class MemoryBackend:
+    """An in-process stand in for MongoDB. Supports the query, update and
+    projection shapes used by mongo_util; anything else raises
+    OperationFailure rather than silently behaving differently.
+
+    Documents live only as long as the backend.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        """
+        Args:
+            latency: Seconds each operation waits for, to imitate a round trip
+        """
+        self.latency = latency
+        self._collections: dict[str, MemoryCollection] = {}
+
+    def collection(self, name: str) -> MemoryCollection:
+        """Gets a collection by name, creating it on first use"""
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(self, name)
+        return self._collections[name]
+
+    async def command(self, command: str) -> dict:
+        """Runs an admin command. Only "ping" is supported"""
+        if command != "ping":
+            raise pymongo.errors.OperationFailure(f"Unsupported command {command}")
+        await self.round_trip()
+        return {"ok": 1.0}
+
+    async def round_trip(self) -> None:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+
+def create_backend(name: str, **options):
+    """Creates a backend by its settings name
+
+    Args:
+        name: "mongo" or "memory"
+        options: Passed to the backend
+
+    Returns:
+        The backend
+
+    Raises:
+        DatabaseError if the backend is unknown
+    """
+    if name == "mongo":
+        return MongoBackend(**options)
+    if name == "memory":
+        return MemoryBackend(**options)
+    raise DatabaseError(
+        message=f"Unknown database backend '{name}'", operation="Create backend"
+    )
+
+
+# ----- Query matching ----- #
+
+
+def _resolve(value: Any, parts: list[str]) -> list[Any]:
+    """Gets every value at a dotted path, descending into arrays the way
+    MongoDB does. An array at the end of the path yields both the array and
+    each of its elements.
+    """
+
+    if not parts:
+        if isinstance(value, list):
+            return [value, *value]
+        return [value]
+
+    head, rest = parts[0], parts[1:]
+
+    if isinstance(value, dict):
+        if head not in value:
+            return []
+        return _resolve(value[head], rest)
+
+    if isinstance(value, list):
+        if head.isdigit():
+            index = int(head)
+            return _resolve(value[index], rest) if index < len(value) else []
+        found = []
+        for item in value:
+            if isinstance(item, dict):
+                found.extend(_resolve(item, parts))
+        return found
+
+    return []
+
+
+def _compare(op: str, candidates: list[Any], operand: Any) -> bool:
+    if op == "$eq":
+        return operand in candidates
+    if op == "$ne":
+        return operand not in candidates
+    if op == "$in":
+        return any(c in operand for c in candidates)
+    if op == "$nin":
+        return not any(c in operand for c in candidates)
+    if op == "$exists":
+        return bool(candidates) == bool(operand)
+
+    comparisons = {
+        "$gt": lambda a, b: a > b,
+        "$gte": lambda a, b: a >= b,
+        "$lt": lambda a, b: a < b,
+        "$lte": lambda a, b: a <= b,
+    }
+    if op in comparisons:
+        return any(
+            comparisons[op](c, operand)
+            for c in candidates
+            if type(c) is type(operand)
+            or (isinstance(c, (int, float)) and isinstance(operand, (int, float)))
+        )
+
+    raise pymongo.errors.OperationFailure(f"Unsupported query operator {op}")
+
+
+def _is_operator_dict(value: Any) -> bool:
+    return (
+        isinstance(value, dict) and len(value) > 0 and next(iter(value)).startswith("$")
+    )
+
+
+def matches(document: dict, query: Optional[dict]) -> bool:
+    """Checks if a document satisfies a query filter
+
+    Args:
+        document: The document to check
+        query: The filter, or None to match everything
+
+    Returns:
+        True if the document matches
+    """
+
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(document, q) for q in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches(document, q) for q in condition):
+                return False
+            continue
+        if key.startswith("$"):
+            raise pymongo.errors.OperationFailure(f"Unsupported query operator {key}")
+
+        candidates = _resolve(document, key.split("."))
+
+        if _is_operator_dict(condition):
+            if not all(_compare(op, candidates, v) for op, v in condition.items()):
+                return False
+        elif condition not in candidates:
+            return False
+
+    return True
+
+
+def _positional_index(document: dict, query: Optional[dict], array_path: str) -> int:
+    """Finds the element of an array that the positional $ refers to: the
+    first one that satisfies the query's conditions on that array
+    """
+
+    array = _resolve(document, array_path.split("."))
+    array = array[0] if array and isinstance(array[0], list) else None
+    if array is None:
+        raise pymongo.errors.WriteError(
+            f"The positional operator did not find the match needed from the query"
+        )
+
+    conditions = {}
+    for key, condition in (query or {}).items():
+        if key == array_path:
+            conditions[""] = condition
+        elif key.startswith(f"{array_path}."):
+            conditions[key[len(array_path) + 1 :]] = condition
+
+    for index, element in enumerate(array):
+        if not conditions:
+            break
+        element_matches = True
+        for sub_path, condition in conditions.items():
+            if sub_path == "":
+                element_matches = matches({"v": element}, {"v": condition})
+            elif isinstance(element, dict):
+                element_matches = matches(element, {sub_path: condition})
+            else:
+                element_matches = False
+            if not element_matches:
+                break
+        if element_matches:
+            return index
+
+    raise pymongo.errors.WriteError(
+        f"The positional operator did not find the match needed from the query"
+    )
+
+
+# ----- Updates ----- #
+
+
+def _split_positional(document: dict, query: Optional[dict], path: str) -> list[str]:
+    """Splits a dotted update path, replacing a positional $ with the index of
+    the matched array element
+    """
+
+    parts = path.split(".")
+    if "$" in parts:
+        position = parts.index("$")
+        array_path = ".".join(parts[:position])
+        parts[position] = str(_positional_index(document, query, array_path))
+    return parts
+
+
+def _parent(document: dict, parts: list[str], create: bool) -> tuple[Any, str]:
+    """Walks to the container that holds the last part of a path"""
+
+    target: Any = document
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            target = target[int(part)]
+        else:
+            if part not in target:
+                if not create:
+                    return None, parts[-1]
+                target[part] = {}
+            target = target[part]
+    return target, parts[-1]
+
+
+def _set(document: dict, parts: list[str], value: Any) -> None:
+    target, key = _parent(document, parts, create=True)
+    if isinstance(target, list):
+        target[int(key)] = value
+    else:
+        target[key] = value
+
+
+def _get(document: dict, parts: list[str], default: Any = None) -> Any:
+    target, key = _parent(document, parts, create=False)
+    if target is None:
+        return default
+    if isinstance(target, list):
+        index = int(key)
+        return target[index] if index < len(target) else default
+    return target.get(key, default)
+
+
+def _array_at(document: dict, parts: list[str]) -> list:
+    array = _get(document, parts)
+    if array is None:
+        array = []
+        _set(document, parts, array)
+    if not isinstance(array, list):
+        raise pymongo.errors.WriteError(f"{'.'.join(parts)} is not an array")
+    return array
+
+
+def apply_update(document: dict, query: Optional[dict], update: dict) -> None:
+    """Applies update operators to a document in place
+
+    Args:
+        document: The document to modify
+        query: The filter that matched it, for the positional $
+        update: The update operators
+    """
+
+    for op, fields in update.items():
+        for path, value in fields.items():
+            parts = _split_positional(document, query, path)
+            value = copy.deepcopy(value)
+
+            if op == "$set":
+                _set(document, parts, value)
+
+            elif op == "$unset":
+                target, key = _parent(document, parts, create=False)
+                if isinstance(target, dict):
+                    target.pop(key, None)
+
+            elif op == "$inc":
+                _set(document, parts, _get(document, parts, 0) + value)
+
+            elif op == "$push":
+                array = _array_at(document, parts)
+                if isinstance(value, dict) and "$each" in value:
+                    array.extend(value["$each"])
+                else:
+                    array.append(value)
+
+            elif op == "$addToSet":
+                array = _array_at(document, parts)
+                items = (
+                    value["$each"]
+                    if isinstance(value, dict) and "$each" in value
+                    else [value]
+                )
+                array.extend(i for i in items if i not in array)
+
+            elif op == "$pull":
+                array = _get(document, parts)
+                if isinstance(array, list):
+                    if isinstance(value, dict) and not _is_operator_dict(value):
+                        kept = [
+                            i
+                            for i in array
+                            if not (isinstance(i, dict) and matches(i, value))
+                        ]
+                    elif _is_operator_dict(value):
+                        kept = [i for i in array if not matches({"v": i}, {"v": value})]
+                    else:
+                        kept = [i for i in array if i != value]
+                    array[:] = kept
+
+            else:
+                raise pymongo.errors.OperationFailure(
+                    f"Unsupported update operator {op}"
+                )
+
+
+# ----- Projections ----- #
+
+
+def project(
+    document: dict, projection: Optional[dict], query: Optional[dict] = None
+) -> dict:
+    """Applies a find projection to a copy of a document
+
+    Args:
+        document: The stored document
+        projection: The projection, or None for the whole document
+        query: The filter that matched it, for the positional $
+
+    Returns:
+        The projected copy
+    """
+
+    if not projection:
+        return copy.deepcopy(document)
+
+    include = any(projection.values())
+
+    if not include:
+        result = copy.deepcopy(document)
+        for path, value in projection.items():
+            if not value:
+                target, key = _parent(result, path.split("."), create=False)
+                if isinstance(target, dict):
+                    target.pop(key, None)
+        return result
+
+    result = {}
+    if projection.get("_id", 1) and "_id" in document:
+        result["_id"] = copy.deepcopy(document["_id"])
+
+    for path, value in projection.items():
+        if path == "_id" or not value:
+            continue
+
+        if path.endswith(".$"):
+            array_path = path[:-2]
+            index = _positional_index(document, query, array_path)
+            array = _get(document, array_path.split("."))
+            _set(result, array_path.split("."), [copy.deepcopy(array[index])])
+            continue
+
+        parts = path.split(".")
+        found = _get(document, parts, default=_missing)
+        if found is not _missing:
+            _set(result, parts, copy.deepcopy(found))
+
+    return result
+
+
+_missing = object()
+
+
+# ----- Collections ----- #
+
+
+class MemoryCursor:
+    """The results of a find or aggregate, iterated with async for"""
+
+    def __init__(self, documents: Iterable[dict], backend: MemoryBackend) -> None:
+        self._documents = list(documents)
+        self._backend = backend
+        self._fetched = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        if not self._fetched:
+            self._fetched = True
+            await self._backend.round_trip()
+        for document in self._documents:
+            yield document
+
+    async def to_list(self, length: Optional[int] = None) -> list[dict]:
+        """Gets the results as a list, like a Motor cursor"""
+        documents = [d async for d in self]
+        return documents if length is None else documents[:length]
+
+
+class MemoryCollection:
+    """A collection of documents kept in a dict keyed by _id. Documents are
+    copied in and out so callers can never alias stored state.
+    """
+
+    def __init__(self, backend: MemoryBackend, name: str) -> None:
+        self.name = name
+        self._backend = backend
+        self._documents: dict[Any, dict] = {}
+
+        # name -> (keys, unique)
+        self._indexes: dict[str, tuple[list[tuple[str, int]], bool]] = {
+            "_id_": ([("_id", pymongo.ASCENDING)], True)
+        }
+
+    def _matching(self, query: Optional[dict]) -> Iterable[dict]:
+        return (d for d in self._documents.values() if matches(d, query))
+
+    def _check_unique(self, document: dict) -> None:
+        for name, (keys, unique) in self._indexes.items():
+            if not unique or name == "_id_":
+                continue
+
+            def key_of(d: dict) -> tuple:
+                return tuple(_get(d, k.split(".")) for k, _ in keys)
+
+            key = key_of(document)
+            for other in self._documents.values():
+                if other["_id"] != document["_id"] and key_of(other) == key:
+                    raise pymongo.errors.DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.name} "
+                        f"index: {name} dup key: {key}"
+                    )
+
+    def _insert(self, document: dict) -> Any:
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        if document["_id"] in self._documents:
+            raise pymongo.errors.DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.name} index: _id_"
+            )
+
+        stored = copy.deepcopy(document)
+        self._check_unique(stored)
+        self._documents[stored["_id"]] = stored
+        return stored["_id"]
+
+    async def insert_one(self, document: dict) -> pymongo.results.InsertOneResult:
+        await self._backend.round_trip()
+        # Like pymongo, the _id is added to the caller's document
+        return pymongo.results.InsertOneResult(self._insert(document), True)
+
+    async def insert_many(
+        self, documents: Iterable[dict]
+    ) -> pymongo.results.InsertManyResult:
+        await self._backend.round_trip()
+        return pymongo.results.InsertManyResult(
+            [self._insert(d) for d in documents], True
+        )
+
+    async def find_one(
+        self, filter: Optional[dict] = None, projection: Optional[dict] = None
+    ) -> Optional[dict]:
+        await self._backend.round_trip()
+        for document in self._matching(filter):
+            return project(document, projection, filter)
+        return None
+
+    def find(
+        self, filter: Optional[dict] = None, projection: Optional[dict] = None
+    ) -> MemoryCursor:
+        return MemoryCursor(
+            [project(d, projection, filter) for d in self._matching(filter)],
+            self._backend,
+        )
+
+    async def count_documents(self, filter: dict) -> int:
+        await self._backend.round_trip()
+        return sum(1 for _ in self._matching(filter))
+
+    async def _update(
+        self, filter: dict, update: dict, many: bool
+    ) -> pymongo.results.UpdateResult:
+        await self._backend.round_trip()
+
+        matched = modified = 0
+        for document in list(self._matching(filter)):
+            matched += 1
+
+            updated = copy.deepcopy(document)
+            apply_update(updated, filter, update)
+            if updated != document:
+                self._check_unique(updated)
+                self._documents[document["_id"]] = updated
+                modified += 1
+
+            if not many:
+                break
+
+        return pymongo.results.UpdateResult(
+            {"n": matched, "nModified": modified, "ok": 1.0}, True
+        )
+
+    async def update_one(
+        self, filter: dict, update: dict
+    ) -> pymongo.results.UpdateResult:
+        return await self._update(filter, update, many=False)
+
+    async def update_many(
+        self, filter: dict, update: dict
+    ) -> pymongo.results.UpdateResult:
+        return await self._update(filter, update, many=True)
+
+    async def _delete(self, filter: dict, many: bool) -> pymongo.results.DeleteResult:
+        await self._backend.round_trip()
+
+        deleted = 0
+        for document in list(self._matching(filter)):
+            del self._documents[document["_id"]]
+            deleted += 1
+            if not many:
+                break
+
+        return pymongo.results.DeleteResult({"n": deleted, "ok": 1.0}, True)
+
+    async def delete_one(self, filter: dict) -> pymongo.results.DeleteResult:
+        return await self._delete(filter, many=False)
+
+    async def delete_many(self, filter: dict) -> pymongo.results.DeleteResult:
+        return await self._delete(filter, many=True)
+
+    def aggregate(self, pipeline: list[dict]) -> MemoryCursor:
+        """Runs a pipeline of $match, $lookup and $project stages"""
+
+        documents = [copy.deepcopy(d) for d in self._documents.values()]
+
+        for stage in pipeline:
+            (name, spec), *extra = stage.items()
+            if extra:
+                raise pymongo.errors.OperationFailure(
+                    "A pipeline stage must have exactly one field"
+                )
+
+            if name == "$match":
+                documents = [d for d in documents if matches(d, spec)]
+            elif name == "$project":
+                documents = [project(d, spec) for d in documents]
+            elif name == "$lookup":
+                documents = [self._lookup(d, spec) for d in documents]
+            else:
+                raise pymongo.errors.OperationFailure(
+                    f"Unsupported pipeline stage {name}"
+                )
+
+        return MemoryCursor(documents, self._backend)
+
+    def _lookup(self, document: dict, spec: dict) -> dict:
+        if "let" in spec:
+            raise pymongo.errors.OperationFailure("$lookup with let is not supported")
+
+        foreign = self._backend.collection(spec["from"])
+        joined = list(foreign._documents.values())
+
+        if "localField" in spec:
+            local = _resolve(document, spec["localField"].split("."))
+            joined = [
+                d
+                for d in joined
+                if any(v in local for v in _resolve(d, spec["foreignField"].split(".")))
+            ]
+
+        for stage in spec.get("pipeline", []):
+            if "$match" not in stage:
+                raise pymongo.errors.OperationFailure(
+                    "Only $match is supported in a $lookup pipeline"
+                )
+            joined = [d for d in joined if matches(d, stage["$match"])]
+
+        document[spec["as"]] = [copy.deepcopy(d) for d in joined]
+        return document
+
+    async def create_index(
+        self, keys: list[tuple[str, int]], unique: bool = False, **_
+    ) -> str:
+        name = "_".join(f"{k}_{d}" for k, d in keys)
+        if name not in self._indexes:
+            self._indexes[name] = (list(keys), unique)
+            if unique:
+                for document in self._documents.values():
+                    self._check_unique(document)
+        return name
+
+    def list_indexes(self) -> MemoryCursor:
+        return MemoryCursor(
+            [
+                {
+                    "v": 2,
+                    "key": dict(keys),
+                    "name": name,
+                    **({"unique": True} if unique and name != "_id_" else {}),
+                }
+                for name, (keys, unique) in self._indexes.items()
+            ],
+            self._backend,
+        )
+
+
+def test():
+    """Tests the memory backend against the shapes mongo_util uses. Used in
+    static test
+    """
+
+    async def test():
+        print("Testing memory backend...")
+
+        backend = MemoryBackend()
+        steps = backend.collection("steps")
+        users = backend.collection("users")
+
+        await users.create_index([("apiKey", pymongo.ASCENDING)], unique=True)
+
+        step = {"stepName": "a", "helpResources": []}
+        result = await steps.insert_one(step)
+        assert step["_id"] == result.inserted_id, "insert did not set _id"
+        step_id = result.inserted_id
+
+        # $push and positional $set
+        for resource_id in ("r1", "r2"):
+            await steps.update_one(
+                {"_id": step_id},
+                {"$push": {"helpResources": {"resourceId": resource_id, "prompt": ""}}},
+            )
+        result = await steps.update_one(
+            {"_id": step_id, "helpResources.resourceId": "r2"},
+            {"$set": {"helpResources.$.prompt": "new"}},
+        )
+        assert result.modified_count == 1, "positional $set did not modify"
+
+        # Positional projection
+        found = await steps.find_one(
+            {"_id": step_id, "helpResources.resourceId": "r2"},
+            {"_id": 0, "helpResources.$": 1},
+        )
+        assert found == {
+            "helpResources": [{"resourceId": "r2", "prompt": "new"}]
+        }, f"bad projection {found}"
+
+        # $pull
+        await steps.update_one(
+            {"_id": step_id}, {"$pull": {"helpResources": {"resourceId": "r1"}}}
+        )
+        found = await steps.find_one({"_id": step_id})
+        assert [r["resourceId"] for r in found["helpResources"]] == ["r2"]
+
+        # Unchanged updates match but do not modify
+        result = await steps.update_one({"_id": step_id}, {"$set": {"stepName": "a"}})
+        assert result.matched_count == 1 and result.modified_count == 0
+
+        # $in and inclusion projections
+        other = (await steps.insert_one({"stepName": "b"})).inserted_id
+        found = [
+            d async for d in steps.find({"_id": {"$in": [step_id, other]}}, {"_id": 1})
+        ]
+        assert found == [{"_id": step_id}, {"_id": other}], f"bad $in {found}"
+
+        # Unique indexes
+        await users.insert_one({"apiKey": "k"})
+        try:
+            await users.insert_one({"apiKey": "k"})
+            raise AssertionError("duplicate key was inserted")
+        except pymongo.errors.DuplicateKeyError:
+            ...
+
+        # $lookup with a pipeline
+        await backend.collection("challenges").insert_one({"_id": "c"})
+        await steps.update_one({"_id": step_id}, {"$set": {"challengeId": "c"}})
+        joined = (
+            await backend.collection("challenges")
+            .aggregate(
+                [
+                    {"$match": {"_id": "c"}},
+                    {
+                        "$lookup": {
+                            "from": "steps",
+                            "pipeline": [{"$match": {"challengeId": "c"}}],
+                            "as": "stepDocuments",
+                        }
+                    },
+                ]
+            )
+            .to_list()
+        )
+        assert [s["_id"] for s in joined[0]["stepDocuments"]] == [step_id]
+
+        print("success")
+
+    asyncio.run(test())
@@ -0,0 +1,200 @@
+"""
+Intecrate API Password Hashing
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
+
+from __future__ import annotations
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import time
+from typing import Callable, Optional
+
+import bcrypt
+
+import cloud_manager.common.settings as s
+from cloud_manager.common.metrics import Counter, Gauge, Metrics
+from cloud_manager.common.tools import log
+from cloud_manager.error import UnavailableError
+
+
+def _hash(string: str) -> tuple[str, float, float]:
+    """Hashes a string with bcrypt. Runs inside a pool worker
+
+    Returns:
+        The hash, the wall time the job started, and the seconds spent hashing
+    """
+    started = time.time()
+    start = time.perf_counter()
+    hashed = bcrypt.hashpw(string.encode("utf-8"), bcrypt.gensalt())
+    return hashed.decode("utf-8"), started, time.perf_counter() - start
+
+
+def _verify(password: str, hashed_password: str) -> tuple[bool, float, float]:
+    """Checks a password against a bcrypt hash. Runs inside a pool worker
+
+    Returns:
+        If the password matches, the wall time the job started, and the
+        seconds spent hashing
+    """
+    started = time.time()
+    start = time.perf_counter()
+    matches = bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
+    return matches, started, time.perf_counter() - start
+
+
+class TimingStats:
+    """Running count, total and maximum of a duration"""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """Records one duration
+
+        Args:
+            seconds: The duration to record
+        """
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+        }
+
+
+class HashingService:
+    """Runs bcrypt in a bounded process pool so hashing never blocks the
+    IOLoop
+    """
+
+    _instance = None
+
+    def __init__(
+        self, workers: Optional[int] = None, queue_depth: Optional[int] = None
+    ) -> None:
+        self.workers = workers if workers is not None else s.HASH_WORKERS
+        self.queue_depth = (
+            queue_depth if queue_depth is not None else s.HASH_QUEUE_DEPTH
+        )
+
+        log(f"starting hashing pool with {self.workers} workers", status="debug")
+
+        # Spawn, rather than fork, a process that is running an IOLoop
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.pending = 0
+        self.rejected = 0
+
+        self.queue_wait = TimingStats()
+        self.hash_time = TimingStats()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = HashingService()
+        return cls._instance
+
+    @classmethod
+    def _after_fork(cls) -> None:
+        """The parent's pool is unusable in a forked child"""
+        cls._instance = None
+
+    async def _run(self, fn: Callable, *args):
+        """Runs a hashing job in the pool and records its timings
+
+        Raises:
+            UnavailableError if the pool queue is full
+        """
+
+        if self.pending >= self.workers + self.queue_depth:
+            self.rejected += 1
+            raise UnavailableError("Too many pending password checks; try again")
+
+        self.pending += 1
+        submitted = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            result, started, elapsed = await loop.run_in_executor(
+                self._executor, fn, *args
+            )
+        finally:
+            self.pending -= 1
+
+        self.queue_wait.observe(max(0.0, started - submitted))
+        self.hash_time.observe(elapsed)
+
+        return result
+
+    async def hash_str(self, string: str) -> str:
+        """Hashes a string with a random salt
+
+        Args:
+            string: The string to hash
+
+        Returns:
+            The bcrypt hash
+        """
+        return await self._run(_hash, string)
+
+    async def verify_password(self, password: str, hashed_password: str) -> bool:
+        """Checks a password against a hash
+
+        Args:
+            password: The plaintext password
+            hashed_password: The bcrypt hash to check against
+
+        Returns:
+            True if the password matches
+        """
+        return await self._run(_verify, password, hashed_password)
+
+    def collect_metrics(self) -> list[Counter]:
+        """Builds the pool metrics for /metrics"""
+
+        pending = Gauge("intecrate_hash_pending", "Hashing jobs queued or running")
+        pending.set(self.pending)
+        rejected = Counter(
+            "intecrate_hash_rejected_total", "Hashing jobs rejected as over capacity"
+        )
+        rejected.inc(self.rejected)
+
+        seconds = Counter(
+            "intecrate_hash_seconds_total", "Time spent by hashing jobs, by phase"
+        )
+        seconds.inc(self.queue_wait.total, phase="queue")
+        seconds.inc(self.hash_time.total, phase="hash")
+        jobs = Counter("intecrate_hash_jobs_total", "Completed hashing jobs")
+        jobs.inc(self.hash_time.count)
+
+        return [pending, rejected, seconds, jobs]
+
+    def stats(self) -> dict:
+        """Gets the queue and timing metrics of the pool"""
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "queue_wait": self.queue_wait.as_dict(),
+            "hash_time": self.hash_time.as_dict(),
+        }
+
+
+os.register_at_fork(after_in_child=HashingService._after_fork)
+
+Metrics.get_instance().add_collector(
+    lambda: HashingService._instance.collect_metrics()
+    if HashingService._instance
+    else []
+)
@@ -0,0 +1,256 @@
+"""
+Intecrate API Invalidation Bus
+
+Tells sibling worker processes about writes, so that they can drop or reload
+what they have cached. Each worker binds a Unix datagram socket in a
+directory shared by the workers of one server; a message is a datagram of
+newline separated "kind:value" tags, sent to every other socket there. No
+broker is involved.
+
+Delivery is best effort: a message to a worker whose receive buffer is full
+is dropped. The periodic reloads and TTLs of each cache bound how long a
+worker can stay stale.
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
+
+from __future__ import annotations
+import asyncio
+import glob
+import os
+import socket
+import tempfile
+from typing import Callable, Iterable, Optional
+
+import tornado.ioloop
+
+from cloud_manager.common.metrics import Counter, Metrics
+from cloud_manager.common.settings import INVALIDATION_BUS_DIR
+from cloud_manager.common.tools import log
+
+# Tags are batched into datagrams of at most this many bytes
+MAX_DATAGRAM = 8192
+
+
+class InvalidationBus:
+    """This process's socket on the bus, and the handlers of each tag kind.
+
+    Until start is called, publish does nothing and nothing is received.
+    """
+
+    _instance = None
+
+    def __init__(self, directory: str, name: Optional[str] = None) -> None:
+        """
+        Args:
+            directory: The directory shared by the workers of one server
+            name: The name of this worker's socket. Defaults to the pid
+        """
+
+        self.directory = directory
+        self.path = os.path.join(directory, f"{name or os.getpid()}.sock")
+
+        self._socket: Optional[socket.socket] = None
+        self._handlers: dict[str, list[Callable[[str], None]]] = {}
+
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            # Workers forked by one server share its pid as their parent
+            cls._instance = InvalidationBus(
+                os.path.join(INVALIDATION_BUS_DIR, str(os.getppid()))
+            )
+        return cls._instance
+
+    @classmethod
+    def _after_fork(cls) -> None:
+        """A child must bind its own socket, under its own pid"""
+        cls._instance = None
+
+    @property
+    def started(self) -> bool:
+        return self._socket is not None
+
+    def subscribe(self, kind: str, handler: Callable[[str], None]) -> None:
+        """Registers a handler for the tags of one kind sent by other workers
+
+        Args:
+            kind: The part of the tag before the colon, e.g. "user"
+            handler: Called on the IOLoop with the rest of the tag
+        """
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def start(self) -> None:
+        """Binds this worker's socket and starts receiving on the IOLoop
+
+        Raises:
+            OSError if the socket cannot be bound
+        """
+
+        if self._socket is not None:
+            return
+
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.bind(self.path)
+        except OSError:
+            sock.close()
+            raise
+        sock.setblocking(False)
+        self._socket = sock
+
+        tornado.ioloop.IOLoop.current().add_handler(
+            sock.fileno(), self._on_readable, tornado.ioloop.IOLoop.READ
+        )
+        log("joined invalidation bus at %s", self.path, status="debug")
+
+    def stop(self) -> None:
+        """Closes and removes this worker's socket"""
+
+        if self._socket is None:
+            return
+
+        tornado.ioloop.IOLoop.current().remove_handler(self._socket.fileno())
+        self._socket.close()
+        self._socket = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def peers(self) -> list[str]:
+        """Gets the socket paths of every other worker"""
+        return [
+            path
+            for path in glob.glob(os.path.join(self.directory, "*.sock"))
+            if path != self.path
+        ]
+
+    def publish(self, tags: Iterable[str]) -> None:
+        """Sends tags to every other worker
+
+        Args:
+            tags: "kind:value" strings, e.g. "challenge:<id>"
+        """
+
+        if self._socket is None:
+            return
+
+        datagrams: list[bytes] = []
+        for tag in tags:
+            encoded = tag.encode("utf-8")
+            if datagrams and len(datagrams[-1]) + 1 + len(encoded) <= MAX_DATAGRAM:
+                datagrams[-1] += b"\n" + encoded
+            else:
+                datagrams.append(encoded)
+
+        if not datagrams:
+            return
+
+        for peer in self.peers():
+            for datagram in datagrams:
+                try:
+                    self._socket.sendto(datagram, peer)
+                    self.sent += 1
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # The worker exited without removing its socket
+                    try:
+                        os.unlink(peer)
+                    except FileNotFoundError:
+                        pass
+                    break
+                except BlockingIOError:
+                    self.dropped += 1
+                    log("invalidation bus peer %s is full", peer, status="warn")
+                except OSError as e:
+                    self.dropped += 1
+                    log(f"failed to send invalidation to {peer}: {e}", status="error")
+
+    def _on_readable(self, fd: int, events: int) -> None:
+        while self._socket is not None:
+            try:
+                datagram = self._socket.recv(MAX_DATAGRAM)
+            except BlockingIOError:
+                return
+
+            self.received += 1
+            for tag in datagram.decode("utf-8", errors="replace").split("\n"):
+                self._dispatch(tag)
+
+    def _dispatch(self, tag: str) -> None:
+        kind, _, value = tag.partition(":")
+        for handler in self._handlers.get(kind, []):
+            try:
+                handler(value)
+            except Exception as e:
+                log(f"invalidation handler for '{tag}' failed: {e}", status="error")
+
+    def collect_metrics(self) -> list[Counter]:
+        """Builds the bus metrics for /metrics"""
+
+        datagrams = Counter(
+            "intecrate_invalidation_datagrams_total",
+            "Invalidation datagrams by outcome",
+        )
+        datagrams.inc(self.sent, outcome="sent")
+        datagrams.inc(self.received, outcome="received")
+        datagrams.inc(self.dropped, outcome="dropped")
+
+        return [datagrams]
+
+
+os.register_at_fork(after_in_child=InvalidationBus._after_fork)
+
+Metrics.get_instance().add_collector(
+    lambda: InvalidationBus._instance.collect_metrics()
+    if InvalidationBus._instance
+    else []
+)
+
+
+def test():
+    """Tests delivery between two sockets on one bus. Used in static test"""
+
+    async def test():
+        print("Testing invalidation bus...")
+
+        with tempfile.TemporaryDirectory() as directory:
+            a = InvalidationBus(directory, "a")
+            b = InvalidationBus(directory, "b")
+
+            received: list[str] = []
+            b.subscribe("challenge", received.append)
+
+            a.publish(["challenge:before-start"])
+            a.start()
+            b.start()
+
+            # A worker that died without cleaning up
+            dead = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            dead.bind(os.path.join(directory, "dead.sock"))
+            dead.close()
+
+            a.publish(["challenge:1", "step:2", "challenge:3"])
+            await asyncio.sleep(0.05)
+
+            assert received == ["1", "3"], f"bad delivery {received}"
+            assert b.peers() == [a.path], f"dead socket was not removed {b.peers()}"
+
+            a.stop()
+            b.stop()
+            assert not os.path.exists(a.path), "socket was not removed"
+
+        print("success")
+
+    asyncio.run(test())
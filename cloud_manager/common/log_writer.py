@@ -0,0 +1,238 @@
+"""
+Intecrate API Log Writer
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
+
+from __future__ import annotations
+import atexit
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Optional, TextIO
+
+import cloud_manager.common.settings as s
+from cloud_manager.common.metrics import Counter, Metrics
+
+
+class LogWriter:
+    """Batches log records to stdout and the log file from a background
+    thread, so logging never blocks the IOLoop on disk I/O.
+
+    Records are dropped (and counted) when the buffer is full.
+    """
+
+    _instance = None
+
+    # The task id of a forked worker. Each worker writes, and rotates, a file
+    # of its own; rotating a file that other processes have open loses logs
+    worker_id: Optional[int] = None
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 0,
+        rotate_interval: float = 0,
+        backup_count: int = 5,
+        buffer_size: int = 10000,
+        flush_interval: float = 0.5,
+    ) -> None:
+        """
+        Args:
+            path: The log file to append to
+            max_bytes: Rotate once the file reaches this size; 0 disables
+            rotate_interval: Rotate after this many seconds; 0 disables
+            backup_count: The number of rotated files to keep
+            buffer_size: The maximum number of records waiting to be written
+            flush_interval: The longest a record waits before being written
+        """
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.dropped = 0
+
+        self._queue: queue.Queue[Optional[tuple[str, str]]] = queue.Queue(
+            maxsize=buffer_size
+        )
+        self._file: Optional[TextIO] = None
+        self._opened_at = 0.0
+        self._closed = False
+
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+        atexit.register(self.close)
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            path = s.LOGFILE
+            if cls.worker_id is not None:
+                root, extension = os.path.splitext(path)
+                path = f"{root}.{cls.worker_id}{extension}"
+
+            cls._instance = LogWriter(
+                path,
+                max_bytes=s.LOG_MAX_BYTES,
+                rotate_interval=s.LOG_ROTATE_INTERVAL,
+                backup_count=s.LOG_BACKUP_COUNT,
+                buffer_size=s.LOG_BUFFER_SIZE,
+                flush_interval=s.LOG_FLUSH_INTERVAL,
+            )
+        return cls._instance
+
+    @classmethod
+    def _after_fork(cls) -> None:
+        """The writer thread does not survive a fork; start a new writer in
+        the child
+        """
+        if cls._instance is not None:
+            cls._instance._closed = True
+        cls._instance = None
+
+    def write(self, console_line: str, file_line: str) -> None:
+        """Queues a record without blocking
+
+        Args:
+            console_line: The line to print to stdout
+            file_line: The line to append to the log file
+        """
+
+        if self._closed:
+            # Shutting down; nothing is left to drain the queue
+            print(console_line)
+            with open(self.path, "a") as f:
+                f.write(f"{file_line}\n")
+            return
+
+        try:
+            self._queue.put_nowait((console_line, file_line))
+        except queue.Full:
+            self.dropped += 1
+
+    def collect_metrics(self) -> list[Counter]:
+        """Builds the dropped record count for /metrics"""
+        dropped = Counter(
+            "intecrate_log_dropped_total", "Log records dropped on a full buffer"
+        )
+        dropped.inc(self.dropped)
+        return [dropped]
+
+    def flush(self) -> None:
+        """Blocks until every queued record has been written"""
+        if not self._closed:
+            self._queue.join()
+
+    def close(self) -> None:
+        """Writes the remaining records and stops the writer thread"""
+
+        if self._closed:
+            return
+        self._closed = True
+
+        # Wait for space rather than dropping the shutdown sentinel
+        self._queue.put(None)
+        self._thread.join()
+
+    def _open(self) -> TextIO:
+        if self._file is None:
+            self._file = open(self.path, "a")
+            self._opened_at = time.monotonic()
+        return self._file
+
+    def _should_rotate(self) -> bool:
+        if self._file is None:
+            return False
+        if self.max_bytes > 0 and self._file.tell() >= self.max_bytes:
+            return True
+        if (
+            self.rotate_interval > 0
+            and time.monotonic() - self._opened_at >= self.rotate_interval
+        ):
+            return True
+        return False
+
+    def _rotate(self) -> None:
+        """Shifts server.log -> server.log.1 -> server.log.2 ..."""
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        if self.backup_count <= 0:
+            open(self.path, "w").close()
+            return
+
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+
+        if os.path.exists(self.path):
+            os.replace(self.path, f"{self.path}.1")
+
+    def _write_batch(self, batch: list[tuple[str, str]]) -> None:
+        sys.stdout.write("".join(f"{console}\n" for console, _ in batch))
+        sys.stdout.flush()
+
+        f = self._open()
+        f.write("".join(f"{line}\n" for _, line in batch))
+        f.flush()
+
+        if self._should_rotate():
+            self._rotate()
+
+    def _run(self) -> None:
+        """Writer thread: waits for a record, then drains whatever else is
+        queued into a single write
+        """
+
+        running = True
+        while running:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._should_rotate():
+                    self._rotate()
+                continue
+
+            batch = []
+            taken = 1
+            while True:
+                if record is None:
+                    running = False
+                else:
+                    batch.append(record)
+                try:
+                    record = self._queue.get_nowait()
+                    taken += 1
+                except queue.Empty:
+                    break
+
+            try:
+                if batch:
+                    self._write_batch(batch)
+            except Exception as e:
+                print(f"log writer failed to write {len(batch)} records: {e}")
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+os.register_at_fork(after_in_child=LogWriter._after_fork)
+
+Metrics.get_instance().add_collector(
+    lambda: LogWriter._instance.collect_metrics() if LogWriter._instance else []
+)
@@ -0,0 +1,264 @@
+"""
+Intecrate API Metrics
+
+In-process counters, gauges and histograms, rendered in the Prometheus text
+exposition format. Each worker process keeps its own values.
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
+
+from __future__ import annotations
+import bisect
+import math
+from typing import Callable, Iterable, Optional
+
+# Histogram bucket bounds in seconds: 0.5ms doubling every two buckets to ~65s
+LATENCY_BUCKETS: list[float] = [round(0.0005 * 2 ** (i / 2), 6) for i in range(35)]
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict[str, object]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """A value that only goes up, per set of labels"""
+
+    TYPE = "counter"
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """Adds to the value of a label set
+
+        Args:
+            amount: The amount to add
+            labels: The labels of the series
+        """
+        key = _labels(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(_labels(labels), 0)
+
+    def samples(self) -> Iterable[tuple[str, Labels, float]]:
+        for labels, value in self.values.items():
+            yield self.name, labels, value
+
+
+class Gauge(Counter):
+    """A value that can go up and down, per set of labels"""
+
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        """Sets the value of a label set
+
+        Args:
+            value: The new value
+            labels: The labels of the series
+        """
+        self.values[_labels(labels)] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class HistogramSeries:
+    """Observation counts in fixed buckets. Memory use does not grow with the
+    number of observations.
+    """
+
+    def __init__(self, bounds: list[float]) -> None:
+        self.bounds = bounds
+        # The last bucket holds everything above the largest bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile as the upper bound of the bucket it falls in
+
+        Args:
+            q: The quantile, between 0 and 1
+
+        Returns:
+            The estimate, or 0 if nothing has been observed
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+
+class Histogram:
+    """A distribution of values, per set of labels"""
+
+    TYPE = "histogram"
+
+    def __init__(
+        self, name: str, help: str, bounds: Optional[list[float]] = None
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.bounds = bounds if bounds is not None else LATENCY_BUCKETS
+        self.series: dict[Labels, HistogramSeries] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        """Records a value
+
+        Args:
+            value: The value to record, e.g. a duration in seconds
+            labels: The labels of the series
+        """
+        key = _labels(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = HistogramSeries(self.bounds)
+        series.observe(value)
+
+    def get(self, **labels) -> Optional[HistogramSeries]:
+        return self.series.get(_labels(labels))
+
+    def samples(self) -> Iterable[tuple[str, Labels, float]]:
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(series.bounds, series.counts):
+                cumulative += count
+                le = (("le", _format_value(bound)),)
+                yield f"{self.name}_bucket", labels + le, cumulative
+            yield f"{self.name}_bucket", labels + (("le", "+Inf"),), series.count
+            yield f"{self.name}_sum", labels, series.sum
+            yield f"{self.name}_count", labels, series.count
+
+
+Metric = Counter | Gauge | Histogram
+
+
+class Metrics:
+    """The metrics of this process. Values are updated from the IOLoop only"""
+
+    _instance = None
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+        self._collectors: list[Callable[[], Iterable[Metric]]] = []
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = Metrics()
+        return cls._instance
+
+    def _get_or_create[T: Metric](self, cls: type[T], name: str, *args) -> T:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args)
+        assert isinstance(metric, cls), f"{name} is already a {metric.TYPE}"
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        """Gets or creates a counter"""
+        return self._get_or_create(Counter, name, help)
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        """Gets or creates a gauge"""
+        return self._get_or_create(Gauge, name, help)
+
+    def histogram(
+        self, name: str, help: str, bounds: Optional[list[float]] = None
+    ) -> Histogram:
+        """Gets or creates a histogram"""
+        return self._get_or_create(Histogram, name, help, bounds)
+
+    def add_collector(self, collector: Callable[[], Iterable[Metric]]) -> None:
+        """Registers a function that builds metrics at scrape time, for values
+        that are owned elsewhere (cache sizes, pool usage...)
+
+        Args:
+            collector: Returns the metrics to render
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Renders every metric in the Prometheus text format
+
+        Returns:
+            The exposition text
+        """
+
+        metrics = list(self._metrics.values())
+        for collector in self._collectors:
+            metrics.extend(collector())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def test():
+    """Tests the histogram buckets and text rendering. Used in static test"""
+
+    print("Testing metrics...")
+
+    metrics = Metrics()
+
+    requests = metrics.counter("test_requests_total", "Requests")
+    requests.inc(endpoint="/a")
+    requests.inc(endpoint="/a")
+    assert requests.get(endpoint="/a") == 2, "counter did not add"
+
+    latency = metrics.histogram("test_latency_seconds", "Latency")
+    for ms in range(1, 101):
+        latency.observe(ms / 1000, endpoint="/a")
+
+    series = latency.get(endpoint="/a")
+    assert series is not None and series.count == 100
+    assert 0.045 <= series.quantile(0.5) <= 0.075, f"bad p50 {series.quantile(0.5)}"
+    assert 0.09 <= series.quantile(0.99) <= 0.15, f"bad p99 {series.quantile(0.99)}"
+
+    text = metrics.render()
+    assert 'test_requests_total{endpoint="/a"} 2' in text, text
+    assert 'test_latency_seconds_bucket{endpoint="/a",le="+Inf"} 100' in text, text
+    assert 'test_latency_seconds_count{endpoint="/a"} 100' in text, text
+
+    print("success")
@@ -0,0 +1,517 @@
+"""
+Intecrate API Resumable Uploads
+
+Sessions for files sent as many chunks, over as many connections as it takes.
+Each session is a data file, preallocated to the full size, that chunks are
+written into at their offsets, and a JSON state file with the byte ranges
+received so far. Both live in a directory shared by every worker; the state
+file is only read and written under an exclusive flock, so any worker can
+continue a session, including after a restart.
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
+
+from __future__ import annotations
+import asyncio
+import contextlib
+import fcntl
+import glob
+import hashlib
+import os
+import time
+from typing import AsyncIterator, Optional
+from uuid import uuid4
+
+import tornado.ioloop
+
+import cloud_manager.datamodel as datamodel
+from cloud_manager.common.settings import RESUMABLE_DIR, RESUMABLE_TTL
+from cloud_manager.common.tools import log
+from cloud_manager.error import FileManagerError, RequestError
+
+# The file extensions each target accepts, as FileManager does
+TARGET_EXTENSIONS: dict[datamodel.UploadTarget, set[str]] = {
+    datamodel.UploadTarget.STEP: {"mp4", "mov"},
+    datamodel.UploadTarget.STEP_RESOURCE: {"mp4", "mov", "md"},
+}
+
+# How long to wait for another request to release a session
+LOCK_WAIT = 1.0
+
+
+def merge_range(ranges: list[list[int]], start: int, end: int) -> list[list[int]]:
+    """Adds a range to a sorted list of disjoint ranges
+
+    Args:
+        ranges: [start, end) ranges, sorted and not touching
+        start: The start of the new range
+        end: The end of the new range (exclusive)
+
+    Returns:
+        The sorted, coalesced ranges
+    """
+
+    merged: list[list[int]] = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _preallocate(path: str, size: int) -> None:
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+class Chunk:
+    """One request's worth of a session's bytes, written in place as they
+    arrive
+    """
+
+    def __init__(self, upload_id: str, path: str, offset: int, length: int) -> None:
+        """
+        Args:
+            upload_id: The session the chunk belongs to
+            path: The session's data file
+            offset: Where in the file the chunk starts
+            length: The number of bytes the request said it would send
+        """
+
+        self.upload_id = upload_id
+        self.offset = offset
+        self.length = length
+        self.written = 0
+
+        self._fd: Optional[int] = os.open(path, os.O_WRONLY)
+
+    def write(self, data: bytes) -> None:
+        """Writes the next bytes of the chunk
+
+        Raises:
+            RequestError if the request sends more than it said it would
+        """
+
+        assert self._fd is not None, "chunk is already closed"
+        if self.written + len(data) > self.length:
+            raise RequestError(message="Chunk is longer than its Content-Length")
+
+        view = memoryview(data)
+        while view:
+            count = os.pwrite(self._fd, view, self.offset + self.written)
+            self.written += count
+            view = view[count:]
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class UploadSessions:
+    """The resumable upload sessions in RESUMABLE_DIR"""
+
+    _instance = None
+
+    def __init__(self, directory: str, ttl: float) -> None:
+        """
+        Args:
+            directory: Where sessions are kept. Should be on the same
+                filesystem as DATA_ROOT, so finished files are moved, not copied
+            ttl: Seconds a session is kept after its last chunk
+        """
+        self.directory = directory
+        self.ttl = ttl
+
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = UploadSessions(RESUMABLE_DIR, RESUMABLE_TTL)
+        return cls._instance
+
+    def _state_path(self, upload_id: str) -> str:
+        return os.path.join(self.directory, f"{upload_id}.json")
+
+    def data_path(self, session: datamodel.UploadSession) -> str:
+        """Gets the file that a session's chunks are written into"""
+        extension = session.filename.split(".")[-1].lower()
+        return os.path.join(self.directory, f"{session.upload_id}.{extension}")
+
+    @contextlib.asynccontextmanager
+    async def _locked(
+        self, upload_id: str, wait: float = LOCK_WAIT
+    ) -> AsyncIterator[tuple[int, datamodel.UploadSession]]:
+        """Holds the lock of a session
+
+        Args:
+            upload_id: The session to lock
+            wait: Seconds to wait for another request to release it
+
+        Yields:
+            The open state file and the session read from it
+
+        Raises:
+            RequestError if the session does not exist or stays locked
+        """
+
+        # Ids are only ever made by create; anything else cannot be a path
+        if not upload_id.isalnum():
+            raise RequestError(message=f"Upload {upload_id} does not exist")
+
+        try:
+            fd = os.open(self._state_path(upload_id), os.O_RDWR)
+        except FileNotFoundError:
+            raise RequestError(message=f"Upload {upload_id} does not exist")
+
+        try:
+            deadline = time.monotonic() + wait
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        raise RequestError(message=f"Upload {upload_id} is busy")
+                    await asyncio.sleep(0.01)
+
+            state = os.pread(fd, os.fstat(fd).st_size, 0)
+            if not state:
+                # Removed while we waited for the lock
+                raise RequestError(message=f"Upload {upload_id} does not exist")
+
+            yield fd, datamodel.UploadSession.model_validate_json(state)
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
+
+    def _save(self, fd: int, session: datamodel.UploadSession) -> None:
+        state = session.model_dump_json(by_alias=True).encode("utf-8")
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, state, 0)
+
+    def _remove(self, fd: int, session: datamodel.UploadSession) -> None:
+        """Removes a session whose lock is held"""
+        for path in (self.data_path(session), self._state_path(session.upload_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        # Requests still waiting on the unlinked file see it as removed
+        os.ftruncate(fd, 0)
+
+    async def create(
+        self, request: datamodel.UploadSessionCreateRequest
+    ) -> datamodel.UploadSession:
+        """Starts a session and preallocates its data file
+
+        Args:
+            request: The file to expect and what to do with it
+
+        Returns:
+            The new session
+
+        Raises:
+            RequestError if the request is incomplete for its target, or the
+            file type is not accepted; FileManagerError if there is no room
+        """
+
+        extension = request.filename.split(".")[-1].lower()
+        if (
+            "." not in request.filename
+            or extension not in TARGET_EXTENSIONS[request.target]
+        ):
+            raise RequestError(
+                message=f"Unsupported file type '{extension}' for {request.target.value}"
+            )
+
+        if request.target == datamodel.UploadTarget.STEP:
+            if request.challenge_id is None or request.step_name is None:
+                raise RequestError(message="STEP uploads need challengeId and stepName")
+        elif request.step_id is None or request.resource_id is None:
+            raise RequestError(
+                message="STEP_RESOURCE uploads need stepId and resourceId"
+            )
+
+        session = datamodel.UploadSession(
+            **request.model_dump(by_alias=True),
+            uploadId=uuid4().hex,
+            received=[],
+            expires=time.time() + self.ttl,
+        )
+
+        # posix_fallocate may fall back to writing zeros; keep it off the IOLoop
+        data_path = self.data_path(session)
+        try:
+            await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, _preallocate, data_path, session.size
+            )
+        except OSError as e:
+            try:
+                os.remove(data_path)
+            except FileNotFoundError:
+                pass
+            raise FileManagerError(f"Failed to allocate {session.size} bytes: {e}")
+
+        fd = os.open(
+            self._state_path(session.upload_id),
+            os.O_RDWR | os.O_CREAT | os.O_EXCL,
+            0o600,
+        )
+        try:
+            self._save(fd, session)
+        finally:
+            os.close(fd)
+
+        log(
+            "started upload %s of %d bytes for %s",
+            session.upload_id,
+            session.size,
+            session.target.value,
+        )
+        return session
+
+    async def get(self, upload_id: str) -> datamodel.UploadSession:
+        """Gets the state of a session
+
+        Raises:
+            RequestError if the session does not exist
+        """
+        async with self._locked(upload_id) as (_, session):
+            return session
+
+    async def start_chunk(self, upload_id: str, offset: int, length: int) -> Chunk:
+        """Checks that a chunk fits in its session, and opens it for writing
+
+        Args:
+            upload_id: The session
+            offset: Where in the file the chunk starts
+            length: The Content-Length of the chunk
+
+        Returns:
+            The chunk, to be passed to finish_chunk once it is written
+
+        Raises:
+            RequestError if the session does not exist or the chunk does not
+            fit in the file
+        """
+
+        async with self._locked(upload_id) as (fd, session):
+            if offset < 0 or length <= 0 or offset + length > session.size:
+                raise RequestError(
+                    message=f"Chunk [{offset}, {offset + length}) is outside the {session.size} byte upload"
+                )
+
+            chunk = Chunk(upload_id, self.data_path(session), offset, length)
+
+            # So that finalizing waits for the chunk to be closed
+            session.writers.append(os.getpid())
+            self._save(fd, session)
+
+        return chunk
+
+    async def finish_chunk(self, chunk: Chunk) -> datamodel.UploadSession:
+        """Records the bytes a chunk wrote, even if it ended early, and
+        extends the session's expiry
+
+        Args:
+            chunk: The chunk
+
+        Returns:
+            The updated session
+        """
+
+        chunk.close()
+
+        async with self._locked(chunk.upload_id) as (fd, session):
+            if chunk.written > 0:
+                session.received = merge_range(
+                    session.received, chunk.offset, chunk.offset + chunk.written
+                )
+            session.expires = time.time() + self.ttl
+            if os.getpid() in session.writers:
+                session.writers.remove(os.getpid())
+            self._save(fd, session)
+
+        return session
+
+    @contextlib.asynccontextmanager
+    async def finalizing(
+        self, upload_id: str
+    ) -> AsyncIterator[tuple[datamodel.UploadSession, str]]:
+        """Holds a complete session while its file is put to use. The session
+        is removed if the block succeeds, and kept for another try if not.
+
+        Args:
+            upload_id: The session
+
+        Yields:
+            The session and the path of its data file
+
+        Raises:
+            RequestError if the session is busy or has chunks still being
+            written, is incomplete, or its file does not match the sha256 it
+            was created with
+        """
+
+        async with self._locked(upload_id, wait=0) as (fd, session):
+            # An open chunk could still write into the file once it is in
+            # use. Chunks of workers that died are closed
+            if any(_is_running(pid) for pid in session.writers):
+                raise RequestError(
+                    message=f"Upload {upload_id} is busy; chunks are still being written"
+                )
+
+            missing = session.size - sum(end - start for start, end in session.received)
+            if missing > 0:
+                raise RequestError(
+                    message=f"Upload {upload_id} is missing {missing} bytes"
+                )
+
+            data_path = self.data_path(session)
+            if session.sha256 is not None:
+                digest = await tornado.ioloop.IOLoop.current().run_in_executor(
+                    None, _sha256_file, data_path
+                )
+                if digest != session.sha256.lower():
+                    raise RequestError(
+                        message=f"Upload {upload_id} does not match its sha256 digest"
+                    )
+
+            yield session, data_path
+
+            self._remove(fd, session)
+
+        log("finalized upload %s", upload_id)
+
+    async def remove_expired(self) -> None:
+        """Removes sessions that have not received a chunk for ttl seconds"""
+
+        now = time.time()
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            upload_id = os.path.basename(path)[: -len(".json")]
+            try:
+                async with self._locked(upload_id, wait=0) as (fd, session):
+                    if session.expires < now:
+                        self._remove(fd, session)
+                        log("removed expired upload %s", upload_id, status="warn")
+            except RequestError:
+                # In use, or already gone
+                continue
+            except ValueError as e:
+                log(f"unreadable upload session {path}: {e}", status="error")
+
+
+def test():
+    """Tests chunked writes and session expiry. Used in static test"""
+
+    import tempfile
+
+    async def test():
+        print("Testing resumable uploads...")
+
+        assert merge_range([[0, 5], [10, 15]], 5, 10) == [[0, 15]]
+        assert merge_range([[10, 15]], 0, 3) == [[0, 3], [10, 15]]
+
+        content = os.urandom(10000)
+
+        with tempfile.TemporaryDirectory() as directory:
+            sessions = UploadSessions(directory, ttl=60)
+            session = await sessions.create(
+                datamodel.UploadSessionCreateRequest(
+                    target=datamodel.UploadTarget.STEP,
+                    filename="main.mp4",
+                    size=len(content),
+                    sha256=hashlib.sha256(content).hexdigest(),
+                    challengeId="challenge",
+                    stepName="step",
+                )
+            )
+            upload_id = session.upload_id
+            assert os.path.getsize(sessions.data_path(session)) == len(content)
+
+            # Out of order, with a chunk that was cut off and sent again
+            for offset, length, sent in [
+                (6000, 4000, 4000),
+                (0, 3000, 1000),
+                (1000, 5000, 5000),
+            ]:
+                chunk = await sessions.start_chunk(upload_id, offset, length)
+                chunk.write(content[offset : offset + sent])
+                await sessions.finish_chunk(chunk)
+
+            # A fresh instance, as a restarted worker would have
+            sessions = UploadSessions(directory, ttl=60)
+            assert (await sessions.get(upload_id)).received == [[0, len(content)]]
+
+            try:
+                await sessions.start_chunk(upload_id, 9000, 2000)
+                raise AssertionError("accepted a chunk past the end")
+            except RequestError:
+                pass
+
+            # A chunk sent again while it is still being written
+            resent = await sessions.start_chunk(upload_id, 0, 1000)
+            try:
+                async with sessions.finalizing(upload_id):
+                    raise AssertionError("finalized with a chunk still open")
+            except RequestError:
+                pass
+            resent.write(content[:1000])
+            await sessions.finish_chunk(resent)
+
+            async with sessions.finalizing(upload_id) as (session, path):
+                with open(path, "rb") as f:
+                    assert f.read() == content, "chunks were not written in place"
+            assert os.listdir(directory) == [], "finalized session was not removed"
+
+            print("Testing upload expiry...")
+
+            expired = await UploadSessions(directory, ttl=-1).create(
+                datamodel.UploadSessionCreateRequest(
+                    target=datamodel.UploadTarget.STEP_RESOURCE,
+                    filename="help.md",
+                    size=10,
+                    stepId="step",
+                    resourceId="resource",
+                )
+            )
+            await sessions.remove_expired()
+            assert os.listdir(directory) == [], "expired session was not removed"
+
+            try:
+                await sessions.get(expired.upload_id)
+                raise AssertionError("found a removed session")
+            except RequestError:
+                pass
+
+        print("success")
+
+    asyncio.run(test())
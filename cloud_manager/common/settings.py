@@ -8,6 +8,7 @@ Licensing Information found at: https://intecrate.co/legal/license
 from __future__ import annotations
 import os
 import json
+from typing import Optional
 
 
 def expand_path(path: str) -> str:
@@ -36,7 +37,34 @@ with open(expand_path(global_config["secrets_path"]), "r") as f:
 
 AUTORELOAD: bool = False
 DEBUG: bool = True
+
+# Worker processes sharing the HTTP port. 0 starts one per CPU
+WORKERS: int = global_config.get("workers", 1)
+WORKER_MAX_RESTARTS: int = global_config.get("worker_max_restarts", 100)
+# With several workers, worker N logs to server.N.log, which it rotates on its
+# own; server.log only has what the parent logged before forking
 LOGFILE: str = os.path.realpath("./server.log")
+# Lowest to highest; a record is written if it is at or above LOG_LEVEL
+LOG_LEVELS: dict[str, int] = {
+    "debug": 10,
+    "info": 20,
+    "warn": 30,
+    "error": 40,
+    "important": 50,
+}
+LOG_LEVEL: str = global_config.get("log_level", "debug")
+if LOG_LEVEL not in LOG_LEVELS:
+    raise ValueError(
+        f"Unknown log_level '{LOG_LEVEL}' in global_config.json; "
+        f"expected one of {', '.join(LOG_LEVELS)}"
+    )
+LOG_BODY_MAX_BYTES: int = global_config.get("log_body_max_bytes", 1024)
+LOG_BODY_SAMPLE_RATE: float = global_config.get("log_body_sample_rate", 1.0)
+LOG_MAX_BYTES: int = global_config.get("log_max_bytes", 50_000_000)
+LOG_ROTATE_INTERVAL: float = global_config.get("log_rotate_interval", 0)
+LOG_BACKUP_COUNT: int = global_config.get("log_backup_count", 5)
+LOG_BUFFER_SIZE: int = global_config.get("log_buffer_size", 10000)
+LOG_FLUSH_INTERVAL: float = global_config.get("log_flush_interval", 0.5)
 
 
 # DB_PATH = global_config["db_path"]
@@ -45,4 +73,89 @@ ROOT_DB_PASSWORD = "030987a6-f874-4c17-aac6-fbcd3388baf6"
 
 COOKIE_SECRET = secrets["cookie_secret"]
 ADMIN_API_KEYS = secrets["admin_keys"]
-ATLAS_PASSWORD = os.environ["ATLAS_PASSWORD"]
+# Only needed by the mongo backend
+ATLAS_PASSWORD: Optional[str] = os.environ.get("ATLAS_PASSWORD")
+
+# "mongo" for Atlas, or "memory" for an in-process database that starts empty
+DB_BACKEND: str = global_config.get("db_backend", "mongo")
+# Simulated round trip of each memory backend operation
+DB_MEMORY_LATENCY_MS: float = global_config.get("db_memory_latency_ms", 0)
+
+# Motor connection pool. Timeouts of None wait forever; compressors are any of
+# "zstd", "zlib" and "snappy", in order of preference
+MONGO_MAX_POOL_SIZE: int = global_config.get("mongo_max_pool_size", 100)
+MONGO_MIN_POOL_SIZE: int = global_config.get("mongo_min_pool_size", 0)
+MONGO_MAX_IDLE_TIME_MS: Optional[int] = global_config.get("mongo_max_idle_time_ms")
+MONGO_WAIT_QUEUE_TIMEOUT_MS: Optional[int] = global_config.get(
+    "mongo_wait_queue_timeout_ms"
+)
+MONGO_COMPRESSORS: list[str] = global_config.get("mongo_compressors", [])
+
+# Database methods slower than this are logged with their query shapes.
+# 0 disables the log
+DB_SLOW_OP_MS: float = global_config.get("db_slow_op_ms", 200)
+
+# Broadcast cache invalidations between workers over Unix datagram sockets
+# (common/invalidation.py), so their caches see each other's writes
+INVALIDATION_BUS: bool = global_config.get("invalidation_bus", WORKERS != 1)
+INVALIDATION_BUS_DIR: str = expand_path(
+    global_config.get("invalidation_bus_dir", os.path.join(DATA_ROOT, "tmp", "bus"))
+)
+
+# Answer If-None-Match on GETs from Database version counters, before the
+# handler runs. Each process numbers its versions from a random epoch, so a
+# version ETag only matches on the worker that issued it; with several workers
+# this is off by default and responses get ETags of their payload instead
+VERSION_ETAGS: bool = global_config.get("version_etags", WORKERS == 1)
+
+# Send X-Db-Queries, the number of database queries a request made, on every
+# response. For development only; it tells clients about the backend
+QUERY_COUNT_HEADER: bool = global_config.get("query_count_header", False)
+
+# Create the indexes in mongo_util.EXPECTED_INDEXES at startup
+ENSURE_INDEXES: bool = global_config.get("ensure_indexes", True)
+
+# API key -> User cache in front of Database.user_by_key
+USER_CACHE_SIZE: int = global_config.get("user_cache_size", 4096)
+USER_CACHE_TTL: float = global_config.get("user_cache_ttl", 30.0)
+
+# Recently rejected API keys, answered without touching the database
+REJECTED_KEY_CACHE_SIZE: int = global_config.get("rejected_key_cache_size", 16384)
+REJECTED_KEY_CACHE_TTL: float = global_config.get("rejected_key_cache_ttl", 60.0)
+
+# Bloom filter of every valid API key, rebuilt from the users collection
+KEY_FILTER_ENABLED: bool = global_config.get("key_filter_enabled", False)
+KEY_FILTER_REFRESH: float = global_config.get("key_filter_refresh", 300.0)
+
+# Hold every challenge and step in process, loaded at startup. Writes from
+# this process update it immediately; writes from other workers arrive over
+# the invalidation bus, or else with the full reload every catalog_refresh
+# seconds (0 disables the reload)
+CATALOG_CACHE: bool = global_config.get("catalog_cache", True)
+CATALOG_REFRESH: float = global_config.get("catalog_refresh", 60.0)
+
+# Streamed admin uploads (base.UploadHandler). The temp directory should be on
+# the same filesystem as data_root, so finished uploads are moved, not copied
+UPLOAD_DIR: str = expand_path(
+    global_config.get("upload_dir", os.path.join(DATA_ROOT, "tmp", "uploads"))
+)
+UPLOAD_MAX_BYTES: int = global_config.get("upload_max_bytes", 2 * 1024**3)
+
+# Resumable chunked uploads (common/resumable.py). Sessions are shared by every
+# worker through this directory, and removed once no chunk has arrived for
+# resumable_ttl seconds. Cleanup runs every resumable_cleanup_interval seconds
+RESUMABLE_DIR: str = expand_path(
+    global_config.get("resumable_dir", os.path.join(DATA_ROOT, "tmp", "resumable"))
+)
+RESUMABLE_TTL: float = global_config.get("resumable_ttl", 24 * 3600.0)
+RESUMABLE_CLEANUP_INTERVAL: float = global_config.get(
+    "resumable_cleanup_interval", 600.0
+)
+
+# Seconds NGINX may cache a checkAuth decision for each Authorization value
+AUTH_ALLOW_TTL: int = global_config.get("auth_allow_ttl", 60)
+AUTH_DENY_TTL: int = global_config.get("auth_deny_ttl", 5)
+
+# bcrypt process pool. Requests beyond workers + queue depth are rejected
+HASH_WORKERS: int = global_config.get("hash_workers", 2)
+HASH_QUEUE_DEPTH: int = global_config.get("hash_queue_depth", 32)
@@ -10,10 +10,24 @@ from __future__ import annotations
 from typing import Optional
 import cloud_manager.datamodel as datamodel
 import cloud_manager.common.settings as s
+from cloud_manager.common.log_writer import LogWriter
 import os
 import bcrypt
 
 
+def log_enabled(status: str) -> bool:
+    """Checks if records of a status would be written. Use to skip building
+    expensive log messages.
+
+    Args:
+        status: The status (level) to check
+
+    Returns:
+        True if the status is at or above the configured log level
+    """
+    return s.LOG_LEVELS[status] >= s.LOG_LEVELS[s.LOG_LEVEL]
+
+
 def log(msg: str, *args, status: str = "info", **kwargs) -> None:
     """
     Colors:
@@ -22,6 +36,9 @@ def log(msg: str, *args, status: str = "info", **kwargs) -> None:
         warn
         important
         debug
+
+    Extra positional args are %-formatted into msg, only if the status is
+    enabled.
     """
     colors = {
         "important": "\x1b[39m",
@@ -33,16 +50,42 @@ def log(msg: str, *args, status: str = "info", **kwargs) -> None:
     END = "\x1b[0m"
 
     if status not in colors.keys():
-        raise KeyError(f"Unsupported log type {log}")
+        raise KeyError(f"Unsupported log type {status}")
+
+    if not log_enabled(status):
+        return
+
+    if args:
+        msg = msg % args
+
     color = colors[status]
 
     if status == "important":
         status = "!"
 
-    print(f"{color}{status}: {msg}{END}")
+    LogWriter.get_instance().write(f"{color}{status}: {msg}{END}", f"{status}: {msg}")
+
 
-    with open(s.LOGFILE, "a") as f:
-        f.write(f"{status}: {msg}\n")
+def truncate(obj, max_length: int) -> str:
+    """Converts an object to a string no longer than max_length. Bytes are
+    cut before they are converted, and keep max_length bytes
+
+    Args:
+        obj: The object to convert
+        max_length: The maximum number of characters (or bytes) to keep
+
+    Returns:
+        The string, with a note of the full length if it was cut
+    """
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        if len(obj) <= max_length:
+            return str(bytes(obj))
+        return f"{bytes(obj[:max_length])}... ({len(obj)} bytes)"
+
+    text = str(obj)
+    if len(text) <= max_length:
+        return text
+    return f"{text[:max_length]}... ({len(text)} chars)"
 
 
 def get_homedir() -> str:
@@ -0,0 +1,388 @@
+"""
+Intecrate API Streamed Uploads
+
+An incremental multipart/form-data parser, for request bodies that are
+handled as they arrive instead of being buffered whole. File parts are
+written to temp files and hashed on the way; memory use does not depend on
+the size of the upload.
+
+Copyright © 2023 Intecrate. All rights reserved.
+Licensing Information found at: https://intecrate.co/legal/license
+"""
+
+from __future__ import annotations
+import hashlib
+import os
+from typing import BinaryIO, Callable, Optional
+from uuid import uuid4
+
+from tornado.httputil import HTTPHeaders, _parse_header
+
+from cloud_manager.error import RequestError
+
+# Bytes a part's headers, or all text fields together, may take
+MAX_HEADER_BYTES = 16 * 1024
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class MultipartParser:
+    """Splits a multipart body into parts, fed in chunks of any size.
+
+    At most one delimiter's worth of body (or one part's headers) is held
+    between calls to feed; everything else is handed to the callbacks.
+    """
+
+    PREAMBLE = "preamble"
+    DELIMITER = "delimiter"
+    HEADERS = "headers"
+    BODY = "body"
+    DONE = "done"
+
+    def __init__(
+        self,
+        boundary: bytes,
+        on_part_begin: Callable[[HTTPHeaders], None],
+        on_part_data: Callable[[bytes], None],
+        on_part_end: Callable[[], None],
+    ) -> None:
+        """
+        Args:
+            boundary: The boundary parameter of the Content-Type
+            on_part_begin: Called with the headers of each part
+            on_part_data: Called with each piece of the current part's body
+            on_part_end: Called after the last piece of each part
+        """
+
+        self.on_part_begin = on_part_begin
+        self.on_part_data = on_part_data
+        self.on_part_end = on_part_end
+
+        self._delimiter = b"\r\n--" + boundary
+        # The first boundary has no CRLF before it; pretend it does
+        self._buffer = b"\r\n"
+        self.state = self.PREAMBLE
+
+    @property
+    def finished(self) -> bool:
+        """If the closing boundary has been seen"""
+        return self.state == self.DONE
+
+    def feed(self, data: bytes) -> None:
+        """Parses the next chunk of the body
+
+        Args:
+            data: The chunk
+
+        Raises:
+            RequestError if the body is malformed
+        """
+
+        self._buffer += data
+
+        while True:
+            if self.state in (self.PREAMBLE, self.BODY):
+                index = self._buffer.find(self._delimiter)
+                if index == -1:
+                    # The tail might be the start of a delimiter
+                    keep = len(self._delimiter) - 1
+                    if len(self._buffer) > keep:
+                        if self.state == self.BODY:
+                            self.on_part_data(self._buffer[:-keep])
+                        self._buffer = self._buffer[-keep:]
+                    return
+
+                if self.state == self.BODY:
+                    if index > 0:
+                        self.on_part_data(self._buffer[:index])
+                    self.on_part_end()
+
+                self._buffer = self._buffer[index + len(self._delimiter) :]
+                self.state = self.DELIMITER
+
+            elif self.state == self.DELIMITER:
+                if len(self._buffer) < 2:
+                    return
+                if self._buffer[:2] == b"--":
+                    self.state = self.DONE
+                    continue
+                if self._buffer[:2] != b"\r\n":
+                    raise RequestError(message="Malformed multipart boundary")
+
+                self._buffer = self._buffer[2:]
+                self.state = self.HEADERS
+
+            elif self.state == self.HEADERS:
+                if self._buffer.startswith(b"\r\n"):
+                    index, headers = 0, HTTPHeaders()
+                else:
+                    index = self._buffer.find(b"\r\n\r\n")
+                    if index == -1:
+                        if len(self._buffer) > MAX_HEADER_BYTES:
+                            raise RequestError(message="Multipart headers too large")
+                        return
+                    try:
+                        headers = HTTPHeaders.parse(
+                            self._buffer[:index].decode("utf-8")
+                        )
+                    except UnicodeDecodeError:
+                        raise RequestError(message="Malformed multipart headers")
+                    index += 2
+
+                self._buffer = self._buffer[index + 2 :]
+                self.state = self.BODY
+                self.on_part_begin(headers)
+
+            else:
+                # Anything after the closing boundary is ignored
+                self._buffer = b""
+                return
+
+
+class UploadedFile:
+    """A file part of an upload, written to a temp file and hashed as it
+    arrives
+    """
+
+    def __init__(self, field: str, filename: str, path: str) -> None:
+        """
+        Args:
+            field: The form field the file was sent as
+            filename: The name of the file on the client
+            path: The temp file to write to
+        """
+
+        self.field = field
+        self.filename = filename
+        self.path = path
+        self.size = 0
+
+        self._sha256 = hashlib.sha256()
+        self._file: Optional[BinaryIO] = open(path, "wb")
+
+    @property
+    def extension(self) -> str:
+        return self.path.split(".")[-1]
+
+    @property
+    def sha256(self) -> str:
+        """The hex digest of the bytes written so far"""
+        return self._sha256.hexdigest()
+
+    def write(self, data: bytes) -> None:
+        assert self._file is not None, f"{self.filename} is already closed"
+        self._file.write(data)
+        self._sha256.update(data)
+        self.size += len(data)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self) -> None:
+        """Closes and removes the temp file, unless it was moved away"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class MultipartUpload:
+    """Collects a streamed multipart/form-data body: file parts go to temp
+    files, and other parts are kept as text fields
+    """
+
+    def __init__(
+        self, boundary: bytes, directory: str, file_fields: dict[str, set[str]]
+    ) -> None:
+        """
+        Args:
+            boundary: The boundary parameter of the Content-Type
+            directory: Where to write temp files. Should be on the same
+                filesystem as their final location, so moving them is cheap
+            file_fields: Every file field the upload must have -> the file
+                extensions it accepts
+        """
+
+        self.directory = directory
+        self.file_fields = file_fields
+
+        self.fields: dict[str, str] = {}
+        self.files: dict[str, UploadedFile] = {}
+
+        self._parser = MultipartParser(
+            boundary, self._part_begin, self._part_data, self._part_end
+        )
+        self._name: Optional[str] = None
+        self._file: Optional[UploadedFile] = None
+        self._text = bytearray()
+        self._text_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_content_type(
+        cls, content_type: str, directory: str, file_fields: dict[str, set[str]]
+    ) -> MultipartUpload:
+        """Starts an upload from the Content-Type of its request
+
+        Raises:
+            RequestError if it is not multipart/form-data with a boundary
+        """
+
+        media_type, params = _parse_header(content_type)
+        boundary = params.get("boundary")
+        if media_type != "multipart/form-data" or not boundary:
+            raise RequestError(message="Expected a multipart/form-data upload")
+
+        return cls(boundary.encode("latin1"), directory, file_fields)
+
+    def feed(self, data: bytes) -> None:
+        """Handles the next chunk of the body
+
+        Raises:
+            RequestError if the body is malformed or has unexpected parts
+        """
+        self._parser.feed(data)
+
+    def _part_begin(self, headers: HTTPHeaders) -> None:
+        disposition, params = _parse_header(headers.get("Content-Disposition", ""))
+        name = params.get("name")
+        if disposition != "form-data" or not name:
+            raise RequestError(message="Multipart part is not a named form field")
+        if name in self.fields or name in self.files:
+            raise RequestError(message=f"Duplicate form field '{name}'")
+
+        self._name = name
+        filename = params.get("filename")
+
+        if filename is None:
+            if name in self.file_fields:
+                raise RequestError(message=f"Form field '{name}' must be a file")
+            self._text = bytearray()
+            return
+
+        extensions = self.file_fields.get(name)
+        if extensions is None:
+            raise RequestError(message=f"Unexpected file field '{name}'")
+
+        extension = filename.split(".")[-1].lower() if "." in filename else ""
+        if extension not in extensions:
+            raise RequestError(
+                message=f"Unsupported file type '{extension}' for '{name}'"
+            )
+
+        self._file = UploadedFile(
+            name, filename, os.path.join(self.directory, f"{uuid4()}.{extension}")
+        )
+        self.files[name] = self._file
+
+    def _part_data(self, data: bytes) -> None:
+        if self._file is not None:
+            self._file.write(data)
+            return
+
+        self._text_bytes += len(data)
+        if self._text_bytes > MAX_FIELD_BYTES:
+            raise RequestError(message="Form fields too large")
+        self._text += data
+
+    def _part_end(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        elif self._name is not None:
+            try:
+                self.fields[self._name] = self._text.decode("utf-8")
+            except UnicodeDecodeError:
+                raise RequestError(message=f"Form field '{self._name}' is not UTF-8")
+        self._name = None
+
+    def finish(self) -> None:
+        """Checks that the whole body was received
+
+        Raises:
+            RequestError if the body ended early or a file field is missing
+        """
+
+        if not self._parser.finished:
+            raise RequestError(message="Incomplete multipart body")
+
+        missing = [name for name in self.file_fields if name not in self.files]
+        if missing:
+            raise RequestError(message=f"Missing file fields {missing}")
+
+    def discard(self) -> None:
+        """Removes every temp file that was not moved away"""
+        for file in self.files.values():
+            file.discard()
+
+
+def test():
+    """Tests parsing a body split at every possible point. Used in static test"""
+
+    import random
+    import tempfile
+
+    print("Testing multipart upload...")
+
+    content = os.urandom(5000) + b"\r\n--not-the-boundary\r\n" + os.urandom(5000)
+    body = (
+        b"preamble\r\n"
+        b"--XyZ\r\n"
+        b'Content-Disposition: form-data; name="stepName"\r\n'
+        b"\r\n"
+        b"Sketch the base\r\n"
+        b"--XyZ\r\n"
+        b'Content-Disposition: form-data; name="video"; filename="Main.MP4"\r\n'
+        b"Content-Type: video/mp4\r\n"
+        b"\r\n" + content + b"\r\n"
+        b"--XyZ--\r\n"
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        for chunk_size in [1, 7, 100, 4096, len(body)]:
+            upload = MultipartUpload.from_content_type(
+                "multipart/form-data; boundary=XyZ", directory, {"video": {"mp4"}}
+            )
+            rest = body
+            while rest:
+                size = random.randint(1, chunk_size)
+                upload.feed(rest[:size])
+                rest = rest[size:]
+            upload.finish()
+
+            assert upload.fields == {"stepName": "Sketch the base"}, upload.fields
+            video = upload.files["video"]
+            with open(video.path, "rb") as f:
+                assert f.read() == content, f"file differs at chunk size {chunk_size}"
+            assert video.sha256 == hashlib.sha256(content).hexdigest()
+            assert video.extension == "mp4"
+
+            upload.discard()
+            assert not os.path.exists(video.path), "temp file was not removed"
+
+        print("Testing malformed uploads...")
+
+        for content_type, data in [
+            ("application/json", b"{}"),
+            ("multipart/form-data; boundary=XyZ", body.replace(b"Main.MP4", b"a.exe")),
+            ("multipart/form-data; boundary=XyZ", body[: len(body) // 2]),
+        ]:
+            bad: Optional[MultipartUpload] = None
+            try:
+                bad = MultipartUpload.from_content_type(
+                    content_type, directory, {"video": {"mp4"}}
+                )
+                bad.feed(data)
+                bad.finish()
+            except RequestError:
+                if bad is not None:
+                    bad.discard()
+                continue
+            raise AssertionError(f"accepted a bad upload: {content_type} {data[:40]}")
+
+        assert os.listdir(directory) == [], "temp files were left behind"
+
+    print("success")
@@ -148,6 +148,11 @@ class StepRequest(BaseModel):
     step_id: str = Field(alias="stepId", description="ObjectID")
 
 
+class ChallengeDetail(BaseModel):
+    challenge: Challenge = Field(alias="challenge")
+    steps: List[Step] = Field([], alias="steps", description="ordered as challenge")
+
+
 class StepCreateRequest(BaseModel):
     challenge_id: str = Field(alias="challengeId", description="ObjectID")
     step_name: str = Field(alias="stepName")
@@ -169,6 +174,57 @@ class StepResourceRequest(BaseModel):
     resource_id: str = Field(alias="resourceId")
 
 
+class StepResourceCreateRequest(BaseModel):
+    step_id: str = Field(alias="stepId")
+    prompt: str = Field(alias="prompt")
+
+
+class UploadTarget(str, Enum):
+    STEP = "STEP"
+    STEP_RESOURCE = "STEP_RESOURCE"
+
+
+class UploadSessionCreateRequest(BaseModel):
+    target: UploadTarget = Field(
+        alias="target",
+        description="STEP creates a step (challengeId, stepName); STEP_RESOURCE "
+        "replaces a resource's content (stepId, resourceId)",
+    )
+    filename: str = Field(alias="filename")
+    size: int = Field(alias="size", gt=0, description="Bytes")
+    sha256: Optional[str] = Field(
+        None, alias="sha256", description="Checked when the upload is finalized"
+    )
+    challenge_id: Optional[str] = Field(None, alias="challengeId")
+    step_name: Optional[str] = Field(None, alias="stepName")
+    step_id: Optional[str] = Field(None, alias="stepId")
+    resource_id: Optional[str] = Field(None, alias="resourceId")
+
+
+class UploadSession(UploadSessionCreateRequest):
+    upload_id: str = Field(alias="uploadId")
+    received: List[List[int]] = Field(
+        [], alias="received", description="Byte ranges [start, end) written so far"
+    )
+    expires: float = Field(
+        alias="expires", description="Unix time when the session is removed"
+    )
+    writers: List[int] = Field(
+        [],
+        alias="writers",
+        description="The worker process of each chunk still being written",
+    )
+
+
+class UploadSessionRequest(BaseModel):
+    upload_id: str = Field(alias="uploadId")
+
+
+class UploadFinalizeResponse(BaseModel):
+    step: Optional[Step] = Field(None, alias="step")
+    resource: Optional[StepResource] = Field(None, alias="resource")
+
+
 class ResourceType(str, Enum):
     VIDEO = "VIDEO"
     MARKDOWN = "MARKDOWN"
@@ -257,6 +313,11 @@ class FileManagerError(BaseModel):
     error_type: str = "File Manager Error"
 
 
+class UnavailableError(BaseModel):
+    message: str = Field("Service Unavailable", alias="message")
+    error_type: str = "Service Unavailable"
+
+
 # class UserListChallengesResponse(BaseModel):
 #     challenge_count: int = Field(alias="challengeCount", description="integer")
 #     challenges: List[Challenge] = Field(alias="challenges")
@@ -278,6 +339,7 @@ class FileManagerError(BaseModel):
 class HttpMethod(Enum):
     POST = "POST"
     GET = "GET"
+    PUT = "PUT"
     DELETE = "DELETE"
 
 
@@ -13,12 +13,12 @@ class CloudManagerError(BaseException):
             self.message = message
         if not hasattr(self, "code"):
             self.code = 500
-        log(f"{self.__class__.__name__}: {message}")
+        log("%s: %s", self.__class__.__name__, message)
         super().__init__(message)
 
     @property
     def json(self):
-        log("Loading error to json")
+        log("Loading error to json", status="debug")
         json_attributes = {
             str(key): str(value)
             for key, value in self.__dict__.items()
@@ -29,7 +29,7 @@ class CloudManagerError(BaseException):
     @property
     def model(self):
         """Converts the error into the corresponding datamodel"""
-        log("Loading error to datamodel")
+        log("Loading error to datamodel", status="debug")
         try:
             return self.DATAMODEL(**self.json)
         except ValidationError as e:
@@ -77,6 +77,14 @@ class FileManagerError(CloudManagerError):
         super().__init__(message)
 
 
+class UnavailableError(CloudManagerError):
+    DATAMODEL = datamodel.UnavailableError
+
+    def __init__(self, message: str) -> None:
+        self.code = 503
+        super().__init__(message)
+
+
 class InternalError(CloudManagerError):
     DATAMODEL = datamodel.InternalError
 
@@ -31,6 +31,11 @@ class FileManager:
             cls._instance = FileManager()
         return cls._instance
 
+    @classmethod
+    def _after_fork(cls) -> None:
+        """Drop the parent's instance, which holds the parent's Database"""
+        cls._instance = None
+
     async def create_challenge(
         self, title: str, description: str, cover_image: str
     ) -> datamodel.Challenge:
@@ -109,7 +114,7 @@ class FileManager:
         if not os.path.exists(temp_filepath):
             raise FileManagerError(f"File {temp_filepath} does not exist")
         file_extension = temp_filepath.split(".")[-1].lower()
-        if file_extension not in ["mp4"]:
+        if file_extension not in ["mp4", "mov"]:
             raise FileManagerError(f"Unsupported video type '{file_extension}'")
 
         # Create in db
@@ -220,7 +225,7 @@ class FileManager:
         """
 
         step = await self.db.get_step_strict(step_id)
-        if resource_id not in step.help_resources:
+        if not any(r.resource_id == resource_id for r in step.help_resources):
             raise FileManagerError(
                 f"Resource {resource_id} does not belong to step {step_id}"
             )
@@ -260,14 +265,14 @@ class FileManager:
         """
 
         step = await self.db.get_step_strict(step_id)
-        if resource_id not in step.help_resources:
+        if not any(r.resource_id == resource_id for r in step.help_resources):
             raise FileManagerError(
                 f"Resource {resource_id} does not belong to step {step_id}"
             )
 
         resource = await self.db.get_step_resource(step_id, resource_id)
         if resource is None:
-            log(f"Resource {resource_id} does not exist", "warn")
+            log(f"Resource {resource_id} does not exist", status="warn")
         else:
             resource_path = resource.resource_path
             if not os.path.exists(resource_path):
@@ -277,6 +282,9 @@ class FileManager:
         await self.db.delete_step_resource(step_id, resource_id)
 
 
+os.register_at_fork(after_in_child=FileManager._after_fork)
+
+
 def test():
     async def test():
         """Tests basic database methods"""
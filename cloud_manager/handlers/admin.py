@@ -1,7 +1,21 @@
+from typing import Optional
+
+import tornado.ioloop
+import tornado.web
+
 from cloud_manager.common.tools import log
 from cloud_manager import datamodel
-from cloud_manager.common.base import BaseHandler, api_get, api_post
-from cloud_manager.error import RequestError
+import cloud_manager.common.settings as s
+from cloud_manager.common.base import (
+    BaseHandler,
+    StreamingHandler,
+    UploadHandler,
+    api_get,
+    api_post,
+    api_put,
+)
+from cloud_manager.common.resumable import Chunk, UploadSessions
+from cloud_manager.error import CloudManagerError, FileManagerError, RequestError
 from cloud_manager.file_management import FileManager
 
 
@@ -28,6 +42,9 @@ class AdminChallengeList(BaseHandler):
     ENDPOINT = "/admin/challenge/list"
     EXPECTED_RESPONSE = datamodel.ChallengeList
 
+    def version_tags(self) -> list[str]:
+        return ["catalog"]
+
     @api_get(requires_admin=True)
     async def get(self) -> datamodel.ChallengeList:
         challenges = await self.db.list_challenges()
@@ -66,16 +83,7 @@ class AdminStepList(BaseHandler):
     @api_post(requires_admin=True)
     async def post(self, request: datamodel.ChallengeRequest) -> datamodel.StepList:
         challenge = await self.db.get_challenge_strict(request.challenge_id)
-        steps: list[datamodel.Step] = []
-        for step_id in challenge.steps:
-            step = await self.db.get_step(step_id)
-            if step is None:
-                log(
-                    f"challenge {challenge.id} contains nonexistent step {step_id}",
-                    status="error",
-                )
-                continue
-            steps.append(step)
+        steps = await self.db.get_steps_many(challenge.steps)
 
         return datamodel.StepList(steps=steps)
 
@@ -115,16 +123,203 @@ class AdminChallengeDelete(BaseHandler):
         )
 
 
-class AdminStepCreate(BaseHandler):
+class AdminStepCreate(UploadHandler):
     """
-    Creates a new step
+    Creates a new step from a multipart/form-data upload with the
+    StepCreateRequest fields and the main video as "video"
     """
 
     ENDPOINT = "/admin/step/create"
     EXPECTED_REQUEST = datamodel.StepCreateRequest
     EXPECTED_RESPONSE = datamodel.Step
+    FILE_FIELDS = {"video": {"mp4", "mov"}}
 
     @api_post(requires_admin=True)
     async def post(self, request: datamodel.StepCreateRequest) -> datamodel.Step:
-        # Not currently implemented via api
-        raise RequestError(message="Not Implemented through API")
+        assert self.upload is not None
+        fm = FileManager.get_instance()
+        return await fm.create_step(
+            request.challenge_id, request.step_name, self.upload.files["video"].path
+        )
+
+
+class AdminStepResourceCreate(UploadHandler):
+    """
+    Adds a help resource to a step from a multipart/form-data upload with the
+    StepResourceCreateRequest fields and the content as "resource"
+    """
+
+    ENDPOINT = "/admin/step/resource/create"
+    EXPECTED_REQUEST = datamodel.StepResourceCreateRequest
+    EXPECTED_RESPONSE = datamodel.StepResource
+    FILE_FIELDS = {"resource": {"mp4", "mov", "md"}}
+
+    @api_post(requires_admin=True)
+    async def post(
+        self, request: datamodel.StepResourceCreateRequest
+    ) -> datamodel.StepResource:
+        assert self.upload is not None
+        fm = FileManager.get_instance()
+        return await fm.add_step_resource(
+            request.step_id, request.prompt, self.upload.files["resource"].path
+        )
+
+
+class AdminUploadCreate(BaseHandler):
+    """
+    Starts a resumable upload, for files too large to send in one request.
+    Chunks are sent to /admin/upload/chunk, in any order and as many times as
+    it takes, then the file is put to use by /admin/upload/finalize
+    """
+
+    ENDPOINT = "/admin/upload/create"
+    EXPECTED_REQUEST = datamodel.UploadSessionCreateRequest
+    EXPECTED_RESPONSE = datamodel.UploadSession
+
+    @api_post(requires_admin=True)
+    async def post(
+        self, request: datamodel.UploadSessionCreateRequest
+    ) -> datamodel.UploadSession:
+        if request.size > s.UPLOAD_MAX_BYTES:
+            raise RequestError(
+                message=f"Uploads are limited to {s.UPLOAD_MAX_BYTES} bytes"
+            )
+
+        # Fail before anything is sent
+        if request.target == datamodel.UploadTarget.STEP:
+            if request.challenge_id is not None:
+                await self.db.get_challenge_strict(request.challenge_id)
+        elif request.step_id is not None and request.resource_id is not None:
+            if (
+                await self.db.get_step_resource(request.step_id, request.resource_id)
+                is None
+            ):
+                raise RequestError(
+                    message=f"Could not find resource {request.resource_id} on step {request.step_id}"
+                )
+
+        return await UploadSessions.get_instance().create(request)
+
+
+class AdminUploadChunk(StreamingHandler):
+    """
+    Writes a chunk of a resumable upload. The body is the bytes of the file
+    starting at the offset query argument, and is written in place as it
+    arrives. Bytes received before a dropped connection are kept
+    """
+
+    ENDPOINT = "/admin/upload/chunk"
+    EXPECTED_RESPONSE = datamodel.UploadSession
+
+    chunk: Optional[Chunk] = None
+    chunk_error: Optional[CloudManagerError] = None
+
+    async def start_stream(self) -> None:
+        upload_id = self.get_query_argument("uploadId", None)
+        if not upload_id:
+            raise RequestError(message="Expected an uploadId argument")
+
+        try:
+            offset = int(self.get_query_argument("offset"))
+        except (tornado.web.MissingArgumentError, ValueError):
+            raise RequestError(message="Expected an integer offset argument")
+
+        try:
+            length = int(self.request.headers["Content-Length"])
+        except (KeyError, ValueError):
+            raise RequestError(message="Chunks must have a Content-Length")
+
+        self.chunk = await UploadSessions.get_instance().start_chunk(
+            upload_id, offset, length
+        )
+
+    def data_received(self, data: bytes) -> None:
+        if self.chunk is None or self.chunk_error is not None:
+            return
+
+        try:
+            self.chunk.write(data)
+        except CloudManagerError as e:
+            self.chunk_error = e
+        except OSError as e:
+            self.chunk_error = FileManagerError(f"Failed to write chunk: {e}")
+
+    @api_put(requires_admin=True)
+    async def put(self) -> datamodel.UploadSession:
+        assert self.chunk is not None
+        chunk, self.chunk = self.chunk, None
+
+        session = await UploadSessions.get_instance().finish_chunk(chunk)
+        if self.chunk_error is not None:
+            raise self.chunk_error
+        return session
+
+    def on_connection_close(self) -> None:
+        super().on_connection_close()
+
+        # Keep what arrived, so the client only resends the rest
+        if self.chunk is not None:
+            chunk, self.chunk = self.chunk, None
+            tornado.ioloop.IOLoop.current().add_callback(
+                UploadSessions.get_instance().finish_chunk, chunk
+            )
+
+    def on_finish(self) -> None:
+        super().on_finish()
+        if self.chunk is not None:
+            chunk, self.chunk = self.chunk, None
+            tornado.ioloop.IOLoop.current().add_callback(
+                UploadSessions.get_instance().finish_chunk, chunk
+            )
+
+
+class AdminUploadStatus(BaseHandler):
+    """
+    Gets the byte ranges a resumable upload has received, to know what is
+    left to send
+    """
+
+    ENDPOINT = "/admin/upload/status"
+    EXPECTED_REQUEST = datamodel.UploadSessionRequest
+    EXPECTED_RESPONSE = datamodel.UploadSession
+
+    @api_post(requires_admin=True)
+    async def post(
+        self, request: datamodel.UploadSessionRequest
+    ) -> datamodel.UploadSession:
+        return await UploadSessions.get_instance().get(request.upload_id)
+
+
+class AdminUploadFinalize(BaseHandler):
+    """
+    Puts a complete resumable upload to use: a STEP upload creates the step,
+    and a STEP_RESOURCE upload replaces the resource's content
+    """
+
+    ENDPOINT = "/admin/upload/finalize"
+    EXPECTED_REQUEST = datamodel.UploadSessionRequest
+    EXPECTED_RESPONSE = datamodel.UploadFinalizeResponse
+
+    @api_post(requires_admin=True)
+    async def post(
+        self, request: datamodel.UploadSessionRequest
+    ) -> datamodel.UploadFinalizeResponse:
+        fm = FileManager.get_instance()
+
+        async with UploadSessions.get_instance().finalizing(request.upload_id) as (
+            session,
+            path,
+        ):
+            if session.target == datamodel.UploadTarget.STEP:
+                assert session.challenge_id is not None
+                assert session.step_name is not None
+                step = await fm.create_step(
+                    session.challenge_id, session.step_name, path
+                )
+                return datamodel.UploadFinalizeResponse(step=step)
+
+            assert session.step_id is not None and session.resource_id is not None
+            resource = await fm.modify_step_resource(
+                session.step_id, session.resource_id, path
+            )
+            return datamodel.UploadFinalizeResponse(resource=resource)
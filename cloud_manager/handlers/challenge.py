@@ -15,8 +15,7 @@ class Challenge(BaseHandler):
 
     @api_post(requires_login=True)
     async def post(self, request: datamodel.ChallengeRequest) -> datamodel.Challenge:
-        api_key = await self.get_api_key_strict()
-        user = await self.db.user_by_key(api_key)
+        user = self.principal.require_user()
 
         # Check if user already has challenge
         for active_challenge in user.challenges:
@@ -37,8 +36,7 @@ class ChallengeAdd(BaseHandler):
 
     @api_post(requires_login=True)
     async def post(self, request: datamodel.ChallengeRequest) -> datamodel.Challenge:
-        api_key = await self.get_api_key_strict()
-        user = await self.db.user_by_key(api_key)
+        user = self.principal.require_user()
 
         # Check if user already has challenge
         for active_challenge in user.challenges:
@@ -61,14 +59,39 @@ class ChallengeList(BaseHandler):
     ENDPOINT = "/challenge/list"
     EXPECTED_RESPONSE = datamodel.ChallengeList
 
+    def version_tags(self) -> list[str]:
+        return ["catalog", f"user:{self.principal.require_user().id}"]
+
     @api_get(requires_login=True)
     async def get(self) -> datamodel.ChallengeList:
-        api_key = await self.get_api_key_strict()
-        user = await self.db.user_by_key(api_key)
-
-        return datamodel.ChallengeList(
-            challenges=[
-                await self.db.get_challenge_strict(c.challenge_id)
-                for c in user.challenges
-            ]
+        user = self.principal.require_user()
+
+        # A dangling challenge is logged and left out rather than failing the list
+        challenges = await self.db.get_challenges_many(
+            [c.challenge_id for c in user.challenges]
         )
+
+        return datamodel.ChallengeList(challenges=challenges)
+
+
+class ChallengeDetail(BaseHandler):
+    """
+    Fetches a challenge in a user's account along with its ordered steps
+    """
+
+    ENDPOINT = "/challenge/detail"
+    EXPECTED_REQUEST = datamodel.ChallengeRequest
+    EXPECTED_RESPONSE = datamodel.ChallengeDetail
+
+    @api_post(requires_login=True)
+    async def post(
+        self, request: datamodel.ChallengeRequest
+    ) -> datamodel.ChallengeDetail:
+        user = self.principal.require_user()
+
+        # Check if user has access to challenge
+        for active_challenge in user.challenges:
+            if active_challenge.challenge_id == request.challenge_id:
+                return await self.db.get_challenge_detail(request.challenge_id)
+
+        raise AuthenticationError("User does not have access to challenge")
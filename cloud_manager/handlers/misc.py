@@ -1,6 +1,9 @@
 from cloud_manager import datamodel
 from cloud_manager.common.base import BaseHandler, api_get, api_post
+from cloud_manager.common.metrics import Metrics
 from cloud_manager.common.tools import log
+from cloud_manager.error import AuthenticationError
+import cloud_manager.common.settings as s
 
 
 class home(BaseHandler):
@@ -65,12 +68,28 @@ class checkAuth(BaseHandler):
     """
     NGINX auth_request endpoint. Evaluates if a user should be able to access
     the private dir.
+
+    Decisions carry X-Accel-Expires/Cache-Control so NGINX can cache them per
+    Authorization value (proxy_cache_key $http_authorization).
     """
 
     ENDPOINT = "/checkAuth"
 
     TEST_IGNORE = True
 
+    def set_decision(self, allow: bool) -> None:
+        """Sets the status and caching headers of an auth decision
+
+        Args:
+            allow: If the request should be let through
+        """
+        ttl = s.AUTH_ALLOW_TTL if allow else s.AUTH_DENY_TTL
+
+        self.set_status(200 if allow else 403)
+        self.set_header("X-Auth-Decision", "allow" if allow else "deny")
+        self.set_header("X-Accel-Expires", str(ttl))
+        self.set_header("Cache-Control", f"private, max-age={ttl}")
+
     async def get(self):
         log("Got checkAuth request")
 
@@ -78,17 +97,39 @@ class checkAuth(BaseHandler):
 
         if api_key is None:
             log("No API key set; rejecting request")
-            self.set_status(403)
+            self.set_decision(False)
             return
 
         log("API key is not unbound, checking self.db for match...")
 
-        user = await self.db.user_by_key(api_key)
-
-        if user is None:
-            log(f"API Key {api_key} is not attached to any use", "warn")
-            self.set_status(403)
+        if await self.db.key_is_valid(api_key):
+            log("Authenticating private request")
+            self.set_decision(True)
 
         else:
-            log(f"Authenticating private request to user {user.id}")
-            self.set_status(200)
+            log(f"API Key {api_key} is not attached to any use", status="warn")
+            self.set_decision(False)
+
+
+class metrics(BaseHandler):
+    """
+    Prometheus scrape endpoint. Admin only.
+
+    Each worker process keeps its own metrics, so with WORKERS > 1 a scrape
+    reports whichever worker accepted it.
+    """
+
+    ENDPOINT = "/metrics"
+
+    TEST_IGNORE = True
+
+    async def get(self):
+        try:
+            await self.assert_admin()
+        except AuthenticationError as e:
+            self.set_status(e.code)
+            self.write(e.model.model_dump(by_alias=True))
+            return
+
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(Metrics.get_instance().render())
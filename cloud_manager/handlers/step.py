@@ -21,8 +21,7 @@ class StepList(BaseHandler):
 
     @api_post(requires_login=True)
     async def post(self, request: datamodel.ChallengeRequest) -> datamodel.StepList:
-        api_key = await self.get_api_key_strict()
-        user = await self.db.user_by_key(api_key)
+        user = self.principal.require_user()
 
         # Check if user has access to challenge
         has_access = False
@@ -35,16 +34,7 @@ class StepList(BaseHandler):
 
         challenge = await self.db.get_challenge_strict(request.challenge_id)
 
-        steps: list[datamodel.Step] = []
-        for step in challenge.steps:
-            s = await self.db.get_step(step)
-            if s is None:
-                log(
-                    f"Challenge {challenge.id} references nonexistent step",
-                    status="error",
-                )
-                continue
-            steps.append(s)
+        steps = await self.db.get_steps_many(challenge.steps)
 
         return datamodel.StepList(steps=steps)
 
@@ -61,8 +51,7 @@ class StepResourceList(BaseHandler):
     @api_post(requires_login=True)
     async def post(self, request: datamodel.StepRequest) -> datamodel.StepResourceList:
         step = await self.db.get_step_strict(request.step_id)
-        api_key = await self.get_api_key_strict()
-        user = await self.db.user_by_key(api_key)
+        user = self.principal.require_user()
 
         has_access = False
         for active_challenge in user.challenges:
@@ -89,8 +78,7 @@ class StepResource(BaseHandler):
     async def post(
         self, request: datamodel.StepResourceRequest
     ) -> datamodel.StepResource:
-        api_key = await self.get_api_key_strict()
-        user = await self.db.user_by_key(api_key)
+        user = self.principal.require_user()
         step = await self.db.get_step_strict(request.step_id)
 
         matching_resource = None
@@ -1,7 +1,8 @@
 import uuid
 from cloud_manager import datamodel
 from cloud_manager.common.base import BaseHandler, api_post
-from cloud_manager.common.tools import hash_str, log, verify_password
+from cloud_manager.common.hashing import HashingService
+from cloud_manager.common.tools import log
 from cloud_manager.error import AuthenticationError, RequestError
 from cloud_manager.handlers.util import util_checkSyntax
 from dateutil.parser import parse as date_parse
@@ -42,7 +43,7 @@ class Login(BaseHandler):
         # Check with database for user
         id = await self.db.id_by_email(email)
 
-        log(f"Fetched id {id} from email {email}", "debug")
+        log(f"Fetched id {id} from email {email}", status="debug")
 
         if id is None:
             raise RequestError("No account registered with this email")
@@ -51,7 +52,8 @@ class Login(BaseHandler):
 
         password_hash = await self.db.get_password_hash(user.id)
 
-        if verify_password(password, password_hash) == False:
+        hashing = HashingService.get_instance()
+        if await hashing.verify_password(password, password_hash) == False:
             raise AuthenticationError(f"Invalid password for {user.id}")
 
         else:
@@ -107,7 +109,7 @@ class Signup(BaseHandler):
         log("Got valid signup request")
 
         # Hash Password
-        password_hash = hash_str(password)
+        password_hash = await HashingService.get_instance().hash_str(password)
 
         user = await self.db.add_user(
             name=name,
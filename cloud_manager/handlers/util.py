@@ -16,10 +16,7 @@ class util_whoami(BaseHandler):
 
     @api_get(requires_login=True)
     async def get(self) -> datamodel.User:
-        api_key = await self.get_api_key_strict()
-        user = await self.db.user_by_key(api_key)
-
-        return user
+        return self.principal.require_user()
 
 
 class util_checkSyntax(BaseHandler):
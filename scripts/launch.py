@@ -1,3 +1,5 @@
 from cloud_manager.webserver import main
 
-main()
+# The hashing pool spawns its workers, which import this module again
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,15 @@ from tests.test_handler import TestFailure, TestHandler
 
 from tests.workflows.user import user_test
 from tests.workflows.admin import admin_test
+from tests.workflows.caching import caching_test
 
 TestHandler.start_server()
 
-TESTS: dict[str, Callable] = {"User Management": user_test, "Admin Control": admin_test}
+TESTS: dict[str, Callable] = {
+    "User Management": user_test,
+    "Admin Control": admin_test,
+    "Conditional GETs": caching_test,
+}
 
 
 def run():
@@ -7,8 +7,35 @@ November 2023
 
 
 from traceback import print_tb
+from typing import Callable
+
 from test_handler import TestHandler
 
+cloud_manager = TestHandler.cloud_manager
+
+# Self-contained module tests; each needs neither the server nor the database
+MODULE_TESTS: list[tuple[str, Callable[[], None]]] = [
+    ("cache", cloud_manager.cache.test),
+    ("catalog", cloud_manager.catalog.test),
+    ("db_backend", cloud_manager.db_backend.test),
+    ("metrics", cloud_manager.metrics.test),
+    ("invalidation", cloud_manager.invalidation.test),
+    ("upload", cloud_manager.upload.test),
+    ("resumable", cloud_manager.resumable.test),
+]
+
+for name, test in MODULE_TESTS:
+    TestHandler.message(f"Testing {name}...")
+
+    try:
+        test()
+    except Exception as e:
+        print_tb(e.__traceback__)
+        TestHandler.report(str(e), name)
+
+    TestHandler.testpass(name, no_shutdown=True)
+
+
 TestHandler.message(f"Testing datamodel...")
 
 try:
@@ -6,12 +6,31 @@ Kyle Tennison
 December 2023
 """
 
+import hashlib
+import os
+import re
+import time
+
 from tests.test_handler import TestFailure, TestHandler
 import requests
 
 
+def upload_dir_is_empty(upload_dir: str) -> bool:
+    """Checks that no temp files are left, allowing the server a moment to
+    remove them after it answers
+    """
+
+    deadline = time.monotonic() + 1
+    while os.path.isdir(upload_dir) and os.listdir(upload_dir):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
 def admin_test():
     datamodel = TestHandler.cloud_manager.datamodel
+    settings = TestHandler.cloud_manager.common.settings
     headers = {"Authorization": TestHandler.INTECRATE_ADMIN_API_KEY}  # type: ignore
 
     #  ----------------------------------------
@@ -146,6 +165,135 @@ def admin_test():
         raise TestFailure(f"/admin/step/list excluded a step(s)")
     print("info: /admin/step/list passed")
 
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    #    /admin/step/create
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    r = requests.post(
+        TestHandler.make_url("/admin/challenge/create"),
+        json=datamodel.ChallengeCreateRequest(
+            title="upload challenge",
+            description="generated in test",
+            coverImage="None",
+        ).model_dump(by_alias=True),
+        headers=headers,
+    )
+    TestHandler.raise_for_status(r)
+    upload_challenge = TestHandler.try_deserialize_model(r.json(), datamodel.Challenge)
+    assert upload_challenge.id is not None, "upload challenge id is unbound"
+
+    video = os.urandom(64 * 1024)
+    fields = datamodel.StepCreateRequest(
+        challengeId=upload_challenge.id, stepName="uploaded step"
+    ).model_dump(by_alias=True)
+
+    for digest, expected in [("0" * 64, 400), (hashlib.sha256(video).hexdigest(), 200)]:
+        r = requests.post(
+            TestHandler.make_url("/admin/step/create"),
+            data={**fields, "videoSha256": digest},
+            files={"video": ("main.mp4", video, "video/mp4")},
+            headers=headers,
+        )
+        if r.status_code != expected:
+            raise TestFailure(
+                f"/admin/step/create should have returned {expected} for videoSha256 {digest}, got {r.status_code}"
+            )
+        if not upload_dir_is_empty(settings.UPLOAD_DIR):
+            raise TestFailure(f"/admin/step/create left files in {settings.UPLOAD_DIR}")
+
+    uploaded_step = TestHandler.try_deserialize_model(r.json(), datamodel.Step)
+    if uploaded_step.challenge_id != upload_challenge.id:
+        raise TestFailure("/admin/step/create added the step to a foreign challenge")
+    print("info: /admin/step/create passed")
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    #      /admin/upload/*
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    content = os.urandom(300 * 1024)
+    r = requests.post(
+        TestHandler.make_url("/admin/upload/create"),
+        json=datamodel.UploadSessionCreateRequest(
+            target=datamodel.UploadTarget.STEP,
+            filename="main.mp4",
+            size=len(content),
+            sha256=hashlib.sha256(content).hexdigest(),
+            challengeId=upload_challenge.id,
+            stepName="resumed step",
+        ).model_dump(by_alias=True),
+        headers=headers,
+    )
+    TestHandler.raise_for_status(r)
+    session = TestHandler.try_deserialize_model(r.json(), datamodel.UploadSession)
+    upload_request = datamodel.UploadSessionRequest(
+        uploadId=session.upload_id
+    ).model_dump(by_alias=True)
+
+    def put_chunk(start: int, end: int) -> None:
+        r = requests.put(
+            TestHandler.make_url("/admin/upload/chunk"),
+            params={"uploadId": session.upload_id, "offset": start},
+            data=content[start:end],
+            headers=headers,
+        )
+        TestHandler.raise_for_status(r)
+
+    # Out of order, leaving [100 KiB, 200 KiB) for later
+    put_chunk(200 * 1024, len(content))
+    put_chunk(0, 100 * 1024)
+
+    r = requests.post(
+        TestHandler.make_url("/admin/upload/status"),
+        json=upload_request,
+        headers=headers,
+    )
+    TestHandler.raise_for_status(r)
+    session = TestHandler.try_deserialize_model(r.json(), datamodel.UploadSession)
+    if session.received != [[0, 100 * 1024], [200 * 1024, len(content)]]:
+        raise TestFailure(f"/admin/upload/status reported {session.received}")
+
+    r = requests.post(
+        TestHandler.make_url("/admin/upload/finalize"),
+        json=upload_request,
+        headers=headers,
+    )
+    if r.status_code != 400:
+        raise TestFailure(
+            f"/admin/upload/finalize should have returned 400 with a range missing, got {r.status_code}"
+        )
+
+    put_chunk(100 * 1024, 200 * 1024)
+
+    r = requests.post(
+        TestHandler.make_url("/admin/upload/finalize"),
+        json=upload_request,
+        headers=headers,
+    )
+    TestHandler.raise_for_status(r)
+    finalized = TestHandler.try_deserialize_model(
+        r.json(), datamodel.UploadFinalizeResponse
+    )
+    if finalized.step is None or finalized.step.challenge_id != upload_challenge.id:
+        raise TestFailure("/admin/upload/finalize did not create the step")
+
+    r = requests.post(
+        TestHandler.make_url("/admin/upload/status"),
+        json=upload_request,
+        headers=headers,
+    )
+    if r.status_code != 400:
+        raise TestFailure(
+            f"/admin/upload/status should have returned 400 once finalized, got {r.status_code}"
+        )
+    print("info: /admin/upload/* passed")
+
+    r = requests.delete(
+        TestHandler.make_url("/admin/challenge/delete"),
+        json=datamodel.ChallengeRequest(challengeId=upload_challenge.id).model_dump(
+            by_alias=True
+        ),
+        headers=headers,
+    )
+    TestHandler.raise_for_status(r)
+
     #  ----------------------------------------
     #          Authentication Tests
     #  ----------------------------------------
@@ -169,6 +317,8 @@ def admin_test():
             r = requests.get(TestHandler.make_url(endpoint))
         elif "delete" in handler.__dict__:
             r = requests.delete(TestHandler.make_url(endpoint))
+        elif "put" in handler.__dict__:
+            r = requests.put(TestHandler.make_url(endpoint))
         else:
             raise TestFailure(
                 f"{endpoint} handler {handler.__name__} has no function to handle"
@@ -180,3 +330,32 @@ def admin_test():
             )
         else:
             print(f"info: {endpoint} passed")
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    #         /metrics
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    for auth_headers in [{}, {"Authorization": "not-a-key"}]:
+        r = requests.get(TestHandler.make_url("/metrics"), headers=auth_headers)
+        if r.status_code != 403:
+            raise TestFailure(
+                f"/metrics should have raised 403 without the admin key, got {r.status_code}"
+            )
+
+    r = requests.get(TestHandler.make_url("/metrics"), headers=headers)
+    TestHandler.raise_for_status(r, check_json=False)
+    if not r.headers.get("Content-Type", "").startswith("text/plain; version=0.0.4"):
+        raise TestFailure(f"/metrics sent Content-Type {r.headers.get('Content-Type')}")
+
+    sample = re.compile(r"^[a-zA-Z_:][a-zA-Z0-9_:]*(\{.*\})? \S+$")
+    for line in r.text.splitlines():
+        if not line.startswith("#") and not sample.match(line):
+            raise TestFailure(f"/metrics sent a malformed sample: {line}")
+
+    # The requests above were timed
+    if not any(
+        line.startswith("intecrate_http_request_duration_seconds_count{")
+        and 'endpoint="/admin/challenge/list"' in line
+        for line in r.text.splitlines()
+    ):
+        raise TestFailure("/metrics has no latency samples for /admin/challenge/list")
+    print("info: /metrics passed")
@@ -0,0 +1,138 @@
+"""
+Conditional GET Test
+Tests that ETags are answered with 304 until the data behind them changes,
+including when it is changed directly in the database.
+"""
+
+import asyncio
+from typing import Optional
+
+from bson.objectid import ObjectId
+from tests.test_handler import TestFailure, TestHandler
+import requests
+
+
+def conditional_get(
+    endpoint: str, headers: dict, etag: Optional[str], expected: int
+) -> str:
+    """Sends a GET with If-None-Match and checks the status
+
+    Args:
+        endpoint: The endpoint to get
+        headers: The request headers
+        etag: The ETag to send, or None to send none
+        expected: The status code to expect
+
+    Returns:
+        The ETag of the response
+    """
+
+    if etag is not None:
+        headers = {**headers, "If-None-Match": etag}
+
+    r = requests.get(TestHandler.make_url(endpoint), headers=headers)
+    if r.status_code != expected:
+        raise TestFailure(
+            f"{endpoint} should have returned {expected} for If-None-Match {etag}, got {r.status_code}"
+        )
+    if expected == 200:
+        TestHandler.raise_for_status(r)
+
+    new_etag = r.headers.get("ETag")
+    if new_etag is None:
+        raise TestFailure(f"{endpoint} sent no ETag")
+    if expected == 304 and new_etag != etag:
+        raise TestFailure(f"{endpoint} sent a different ETag with its 304")
+    if expected == 200 and new_etag == etag:
+        raise TestFailure(f"{endpoint} kept its ETag after the data changed")
+
+    return new_etag
+
+
+def caching_test():
+    datamodel = TestHandler.cloud_manager.datamodel
+    settings = TestHandler.cloud_manager.common.settings
+
+    admin_headers = {"Authorization": TestHandler.INTECRATE_ADMIN_API_KEY}  # type: ignore
+    user_headers = {"Authorization": TestHandler.INTECRATE_TEST_USER_KEY}  # type: ignore
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    #   200 -> 304 -> change
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    admin_list = conditional_get("/admin/challenge/list", admin_headers, None, 200)
+    admin_list = conditional_get(
+        "/admin/challenge/list", admin_headers, admin_list, 304
+    )
+    whoami = conditional_get("/util/whoami", user_headers, None, 200)
+    whoami = conditional_get("/util/whoami", user_headers, whoami, 304)
+    challenge_list = conditional_get("/challenge/list", user_headers, None, 200)
+    challenge_list = conditional_get(
+        "/challenge/list", user_headers, challenge_list, 304
+    )
+
+    r = requests.post(
+        TestHandler.make_url("/admin/challenge/create"),
+        json=datamodel.ChallengeCreateRequest(
+            title="conditional get challenge",
+            description="generated in test",
+            coverImage="None",
+        ).model_dump(by_alias=True),
+        headers=admin_headers,
+    )
+    TestHandler.raise_for_status(r)
+    challenge = TestHandler.try_deserialize_model(r.json(), datamodel.Challenge)
+    assert challenge.id is not None, "new challenge id is unbound"
+
+    admin_list = conditional_get(
+        "/admin/challenge/list", admin_headers, admin_list, 200
+    )
+    print("info: /admin/challenge/list conditional GET passed")
+
+    r = requests.post(
+        TestHandler.make_url("/challenge/add"),
+        json=datamodel.ChallengeRequest(challengeId=challenge.id).model_dump(
+            by_alias=True
+        ),
+        headers=user_headers,
+    )
+    TestHandler.raise_for_status(r)
+
+    whoami = conditional_get("/util/whoami", user_headers, whoami, 200)
+    challenge_list = conditional_get(
+        "/challenge/list", user_headers, challenge_list, 200
+    )
+    print("info: /util/whoami and /challenge/list conditional GETs passed")
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    #  Change in the database
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~
+    # As another deployment or a maintenance script would, without telling
+    # the server: take the new challenge off the user again. Responses may be
+    # stale until the server's user cache expires
+    async def change_directly():
+        db = TestHandler.cloud_manager.mongo_util.Database.get_instance()
+        user = await db.user_by_key(user_headers["Authorization"])
+
+        await db.users.update_one(
+            {"_id": ObjectId(user.id)},
+            {"$pull": {"challenges": {"challengeId": challenge.id}}},
+        )
+
+        wait = settings.USER_CACHE_TTL + 1
+        print(f"info: waiting {wait}s for the server's user cache to expire")
+        await asyncio.sleep(wait)
+
+        conditional_get("/util/whoami", user_headers, whoami, 200)
+        conditional_get("/challenge/list", user_headers, challenge_list, 200)
+
+    asyncio.run(change_directly())
+    print("info: conditional GETs after a direct database change passed")
+
+    r = requests.delete(
+        TestHandler.make_url("/admin/challenge/delete"),
+        json=datamodel.ChallengeRequest(challengeId=challenge.id).model_dump(
+            by_alias=True
+        ),
+        headers=admin_headers,
+    )
+    TestHandler.raise_for_status(r)
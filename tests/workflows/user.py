@@ -25,6 +25,41 @@ def user_test():
 
     print("info: /util/whoami passed")
 
+    # ~~~~~~~~~~~~~~~~~~~~
+    #     /checkAuth
+    # ~~~~~~~~~~~~~~~~~~~~
+    # NGINX caches each decision for as long as its headers say
+    settings = TestHandler.cloud_manager.common.settings
+    for name, auth_headers, status, decision, ttl in [
+        (
+            "allow",
+            {"Authorization": user.api_key},
+            200,
+            "allow",
+            settings.AUTH_ALLOW_TTL,
+        ),
+        ("deny", {"Authorization": "not-a-key"}, 403, "deny", settings.AUTH_DENY_TTL),
+        ("missing key", {}, 403, "deny", settings.AUTH_DENY_TTL),
+    ]:
+        r = requests.get(TestHandler.make_url("/checkAuth"), headers=auth_headers)
+        if r.status_code != status:
+            raise TestFailure(
+                f"/checkAuth {name} should have returned {status}, got {r.status_code}"
+            )
+        if r.headers.get("X-Auth-Decision") != decision:
+            raise TestFailure(
+                f"/checkAuth {name} sent X-Auth-Decision {r.headers.get('X-Auth-Decision')}"
+            )
+        if r.headers.get("X-Accel-Expires") != str(ttl):
+            raise TestFailure(
+                f"/checkAuth {name} sent X-Accel-Expires {r.headers.get('X-Accel-Expires')}"
+            )
+        if r.headers.get("Cache-Control") != f"private, max-age={ttl}":
+            raise TestFailure(
+                f"/checkAuth {name} sent Cache-Control {r.headers.get('Cache-Control')}"
+            )
+    print("info: /checkAuth passed")
+
     # ~~~~~~~~~~~~~~~~~~~~
     #     /user/signup
     # ~~~~~~~~~~~~~~~~~~~~
@@ -128,6 +163,24 @@ def user_test():
     step = step_list.steps[0]
     print("info: /step/list passed")
 
+    # ~~~~~~~~~~~~~~~~~~~~
+    #  /challenge/detail
+    # ~~~~~~~~~~~~~~~~~~~~
+    r = requests.post(
+        TestHandler.make_url("/challenge/detail"),
+        json=datamodel.ChallengeRequest(challengeId=CHALLENGE_ID).model_dump(
+            by_alias=True
+        ),
+        headers=auth_headers,
+    )
+    TestHandler.raise_for_status(r)
+    detail = TestHandler.try_deserialize_model(r.json(), datamodel.ChallengeDetail)
+    if detail.challenge.id != added_challenge.id:
+        raise TestFailure("/challenge/detail returned foreign challenge")
+    if [s.id for s in detail.steps] != [s.id for s in step_list.steps]:
+        raise TestFailure("/challenge/detail steps do not match /step/list")
+    print("info: /challenge/detail passed")
+
     # ~~~~~~~~~~~~~~~~~~~~
     # /step/resource/list
     # ~~~~~~~~~~~~~~~~~~~~